@@ -0,0 +1,28 @@
+'''conditional_response: like catsoop's raw_response handler, but supporting conditional GETs
+
+Content files set cs_handler = 'conditional_response', plus content_type and response as
+for raw_response.  They may also set response_headers, a dict of extra HTTP headers.  If
+those include an ETag which matches the request's If-None-Match header, then an empty
+304 Not Modified response is returned instead of the content.  They may also set
+response_status, an (HTTP status code, reason) tuple, e.g. ("429", "Too Many Requests"),
+for responses other than 200 OK; these are never replaced by a 304.
+'''
+
+def handle(context):
+    content = context["response"]
+    typ = context.get("content_type", "text/plain")
+
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    headers = {"Content-type": typ}
+    headers.update(context.get("response_headers", {}))
+
+    status = context.get("response_status", ("200", "OK"))
+    etag = headers.get("ETag")
+    if_none_match = context.get("cs_env", {}).get("HTTP_IF_NONE_MATCH", "")
+    if status[0] == "200" and etag and etag in [x.strip() for x in if_none_match.split(",")]:
+        headers["Content-length"] = "0"
+        return ("304", "Not Modified"), headers, b""
+
+    headers["Content-length"] = str(len(content))
+    return status, headers, content
@@ -5,10 +5,13 @@ var CatsoopBroadcast = function(){
     var div_id = "cs_broadcast_msg_div";
     var minfo;	// message info
     var seen = [];
-    var poll_period_ms = 1500;
+    var poll_period_ms = 1500;		// poll interval while a message is live
+    var poll_idle_max_ms = 30000;	// longest poll interval (backing off) while no message is live
+    var poll_delay_ms = poll_period_ms;
     var positioner_started = false;
     var iframe_ntries = 20;
     var n_poll_errors = 0;
+    var last_response = null;	// body of last poll response, to skip re-parsing unchanged messages
 
     var get_state = function(){
 	try{
@@ -38,10 +41,36 @@ var CatsoopBroadcast = function(){
 	window.localStorage.setItem('cs_broadcast', JSON.stringify(seen));
     }
 
-    var get_msg = function(){
+    var message_is_live = function(){
+	// true if the current message has not expired (messages without "expires" last 3 minutes)
+	if (!minfo || !minfo.datetime){
+	    return false;
+	}
+	if (minfo.expires){
+	    return Date.now() < minfo.expires * 1000;
+	}
+	return (Date.now() - Date.parse(minfo.datetime)) / 1000 <= 3*60;
+    }
+
+    var update_poll_delay = function(xmlhttp){
+	// poll at the server's hint (X-Next-Poll-Ms) while a message is live, or when rate limited; else back off exponentially
+	var hint = parseInt(xmlhttp.getResponseHeader('X-Next-Poll-Ms'));
+	if (xmlhttp.status == 429){
+	    poll_delay_ms = Math.max(poll_delay_ms, hint || poll_idle_max_ms);
+	}
+	else if (message_is_live()){
+	    poll_delay_ms = hint || poll_period_ms;
+	}
+	else{
+	    poll_delay_ms = Math.min(poll_delay_ms * 2, hint || poll_idle_max_ms);
+	}
+    }
+
+    var get_msg = function(done){
 	// load msg via ajax and popup, if not expired, and if not already seen
 	// var url = "/cat-soop/6.036/broadcast?get";
-	var url = `${CS_COURSE_URL}/broadcast?get`;
+	// CS_BROADCAST_URL is the message file for this user's audience (everyone, or staff)
+	var url = (typeof CS_BROADCAST_URL !== 'undefined') ? CS_BROADCAST_URL : `${CS_COURSE_URL}/broadcast?get`;
 	// console.log("[load_msg] Loading msg from ", url);
 
 	var xmlhttp = new XMLHttpRequest();
@@ -49,7 +78,16 @@ var CatsoopBroadcast = function(){
 	xmlhttp.onreadystatechange = function() {
 	    if (xmlhttp.readyState == XMLHttpRequest.DONE) {   // XMLHttpRequest.DONE == 4
 		if (xmlhttp.status == 200) {
-		    process_msg(xmlhttp.responseText);
+		    if (xmlhttp.responseText !== last_response){
+			last_response = xmlhttp.responseText;
+			process_msg(xmlhttp.responseText);
+		    }
+		    n_poll_errors = 0;
+		}
+		else if (xmlhttp.status == 304) {	// not modified
+		    n_poll_errors = 0;
+		}
+		else if (xmlhttp.status == 429) {	// polling too often: wait as told (X-Next-Poll-Ms)
 		    n_poll_errors = 0;
 		}
 		else if (xmlhttp.status == 400) {
@@ -60,6 +98,10 @@ var CatsoopBroadcast = function(){
 		    console.log('[load_msg] something else other than 200 was returned');
 		    n_poll_errors = n_poll_errors + 1;
 		}
+		update_poll_delay(xmlhttp);
+		if (done){
+		    done();
+		}
 	    }
 	};
 	xmlhttp.open("GET", url, true);
@@ -81,14 +123,11 @@ var CatsoopBroadcast = function(){
 	    console.log(`[load_msg] malformed msg ${minfo}, no date...skipping`);
 	    return;
 	}
-	if (minfo && new_minfo==minfo.datetime){	// same message as current one
+	if (minfo && new_minfo.version==minfo.version && new_minfo.datetime==minfo.datetime){	// same message as current one
 	    return;
 	}
 	minfo = new_minfo;
-	var mdate = Date.parse(minfo.datetime);
-	var now = new Date();
-	var ddifsec = (now.getTime() - mdate) / 1000;
-	if (ddifsec > 3*60){
+	if (!message_is_live()){
 	    console.log(`[load_msg] message ${minfo.datetime} has expired, skipping`);
 	    return;
 	}
@@ -175,11 +214,37 @@ var CatsoopBroadcast = function(){
 
     var msg_check = function(){
 	// console.log("msg_check!");
-	get_msg();
-	if (n_poll_errors < 20){
+	get_msg(function(){
+	    if (n_poll_errors < 20){
+		setTimeout(msg_check, poll_delay_ms);
+	    }
+	});
+    };
+
+    var start_events = function(){
+	// receive messages pushed by the broadcast_push service; fall back to polling if unavailable
+	var events_url;
+	try{
+	    events_url = CS_BROADCAST_EVENTS_URL;
+	}catch(err){
+	    events_url = null;
+	}
+	if (!events_url || !window.EventSource){
 	    setTimeout(msg_check, poll_period_ms);
+	    return;
 	}
-    };
+	// events_url carries a token, signed by catsoop, which tells the service this user's audience
+	var source = new EventSource(events_url);
+	source.onmessage = function(event){
+	    process_msg(event.data);
+	};
+	source.onerror = function(){
+	    if (source.readyState == EventSource.CLOSED){	// not reconnecting: poll instead
+		console.log("[load_msg] broadcast event stream unavailable, polling instead");
+		setTimeout(msg_check, poll_period_ms);
+	    }
+	};
+    }
 
     var setup_msg_box = function(){
 	var node = document.createElement("div");
@@ -192,7 +257,7 @@ var CatsoopBroadcast = function(){
 
 	document.body.append(node);
 	document.querySelector('#cs_broadcast_close').addEventListener("click", close_msg);
-	setTimeout(msg_check, poll_period_ms);
+	start_events();
     }
 
     var setup = function(){
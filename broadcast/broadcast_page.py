@@ -0,0 +1,439 @@
+'''broadcast: real-time announcements to all catsoop users of this site
+
+Staff: access this page to enter a message and submit it to be
+broadcast.  The message is stored on the server as a json dict, with
+timestamp and author.  All messages are also archived in a catsoop log
+file.
+
+Students: javascript code (automatically loaded) polls the server for
+a broadcast message, and displays it if unexpired (e.g. within 5
+minutes of creation).  Once marked as having been seen, it is not
+redisplayed.
+
+Each saved message carries a version number, one more than that of
+the previously published message.  The current message is published
+as pre-rendered JSON, in one file per audience: MSG_FILE holds the
+latest message for everyone, and STAFF_MSG_FILE the latest message of
+any audience, for staff.  Both are meant to be served directly by
+nginx, and the page's javascript is pointed at the right one for the
+user's role (see cs_add_broadcast_messaging_js in preload.py).  The
+files are published atomically (written to a temporary file, then
+renamed), so readers never see a partially written message.
+
+The ?get endpoint returns the file for the user's role as is (it does
+not read the log).  It sends an ETag, and replies 304 Not Modified
+when the client already has the current message (this uses the
+conditional_response handler in __HANDLERS__).
+
+Each message expires MESSAGE_TTL seconds after it is sent (its
+"expires" field, in seconds since the epoch).  While the current
+message is live, ?get tells clients to poll again after POLL_LIVE_MS
+(in an X-Next-Poll-Ms header); otherwise clients back off, up to
+POLL_IDLE_MS between polls, and the response may be cached for
+IDLE_MAX_AGE seconds.
+
+Each user's ?get requests are rate limited (see RateLimiter in the
+top-level preload.py) to POLL_RATE per second, after a burst of up to
+POLL_BURST; requests beyond that get an empty 429 Too Many Requests
+response, with Retry-After and X-Next-Poll-Ms headers saying when to
+poll again, without the message file being read.
+
+Staff can see counts and latency histograms of each action, and of the
+csm_cslog calls made, with ?stats (see RequestMetrics in the top-level
+preload.py).
+
+This module is the page's code, imported once per catsoop worker
+process: content.py, which catsoop runs on every request, imports it
+with cs_import_page_module (from the top-level preload.py) and runs
+BroadcastMessage(globals()).dispatch(cs_form).  BroadcastMessage gets
+the request's globals (cs_username, csm_cslog, ...) from that context
+dict, and sets catsoop's response variables (cs_handler, response, ...)
+in it.
+'''
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import concurrent.futures
+import logging
+import tempfile
+import urllib.request
+import datetime
+import traceback
+
+LOGGER = logging.getLogger("cs")
+
+#-----------------------------------------------------------------------------
+# main dispatch function
+'''
+How this works:
+
+content.py runs:
+    BM = broadcast_page.BroadcastMessage(globals())
+    cs_problem_spec = BM.dispatch(cs_form)
+
+This tells catsoop to use the dispatch function of the RemoteQueue for all processing
+
+RemoteQueue.dispatch
+    Given the form data for the page and the person viewing the page, it determines what the person should see.
+    If staff and form_data is empty: show the form for inputting video URL
+    If staff and person has saved info/pressed submit: show 'saved' and save data and update remotequeue database:
+            data = {'url': url, 'active': active}
+            self.cslog.update_log(self.db_name, [], self.username, data)
+    If person is not staff: run ajax_get_url
+'''
+class BroadcastMessage:
+
+    db_name = "broadcast_message"
+    MSG_FILE = "~/cs_broadcast.json"	# latest message for everyone
+    STAFF_MSG_FILE = "~/cs_broadcast_staff.json"	# latest message for staff (of any audience)
+    PUSH_NOTIFY_URL = "http://127.0.0.1:3200/notify"	# broadcast_push service; None to disable
+    HISTORY_BUCKET = 50	# messages per history log
+    HISTORY_PAGE = 20	# messages per page of history on the staff form
+    MESSAGE_TTL = 180	# seconds for which a message is shown
+    POLL_LIVE_MS = 1500	# client poll interval while a message is live
+    POLL_IDLE_MS = 30000	# longest client poll interval while no message is live
+    IDLE_MAX_AGE = 5	# seconds for which clients may cache ?get while no message is live
+    COURSES = []	# other courses on this catsoop site, with the same staff, which messages may also be saved to
+    SAVE_WORKERS = 8	# threads saving a message to several courses
+    POLL_RATE = 2	# ?get requests per second allowed for each user (over all their tabs) ...
+    POLL_BURST = 20	# ... after a burst of this many
+    ACTIONS = ['show_form', 'process_form_save', 'ajax_stats', 'ajax_get_msg']
+
+    def __init__(self, context, verbose=True):
+        self.context = context		# the request's globals, in which catsoop runs content.py
+        self.username = context['cs_username']
+        self.verbose = verbose
+        user_role = context['cs_user_info'].get('role', None)
+        self.is_staff = user_role in {'LA', 'TA', 'UTA', 'Admin', 'Instructor'}
+        self.is_authorized = user_role in {'TA','Admin', 'Instructor'}
+        self.my_url = "/".join([context['cs_url_root']] + context['cs_path_info'])
+        self.course = context['_course_number']
+        # RequestMetrics and RateLimiter are defined in the top-level preload.py
+        self.metrics = context['RequestMetrics'](self.db_name, self.ACTIONS)
+        self.poll_limiter = context['RateLimiter'](self.db_name, self.POLL_RATE, self.POLL_BURST)
+
+    @property
+    def cslog(self):
+        '''
+        csm_cslog, as it is in the context now (dispatch swaps in a timed stand-in, see RequestMetrics.timing_cslog)
+        '''
+        return self.context['csm_cslog']
+
+    def dispatch(self, form_data=None):
+        '''
+        main entry point to generate html responses
+        The latency of each action, and of the csm_cslog calls it makes, is recorded in self.metrics.
+        '''
+        action, args = self.route(form_data)
+        if action is None:
+            return ""
+        try:
+            with self.metrics.timing_cslog(self.context):
+                return self.metrics.timed('action', action, getattr(self, action), *args)
+        finally:
+            self.metrics.flush()
+            if self.context.get('cs_handler') and 'queue_profile_finish' in self.context:
+                self.context['queue_profile_finish']()	# ajax responses skip the queue plugin's post_handle, which would save the profile
+
+    def route(self, form_data):
+        '''
+        Return (name of the method which should handle form_data, its arguments); the name is None if there is nothing to do
+        '''
+        if form_data is None:
+            return None, ()
+        if not len(form_data) and self.is_authorized:
+            return 'show_form', ()
+        if 'Broadcast' in form_data and self.is_authorized:
+            return 'process_form_save', (form_data,)
+        if 'stats' in form_data and self.is_staff:
+            return 'ajax_stats', ()
+        if 'get' in form_data:
+            return 'ajax_get_msg', (form_data,)
+        if 'before' in form_data and self.is_authorized:
+            return 'show_form', ("", form_data.get('before'))
+        if self.is_authorized:
+            return 'show_form', ()
+        return None, ()
+        #return "<pre>%s</pre>" % form_data   # for debugging
+
+    def ajax_get_msg(self, form_data):
+        '''
+        If staff claimant is active, and has remote url, then return a link to this service, but with "go=<staffuser>"
+        This will let us log actual number of clicks to start video sessions.
+        '''
+        allowed, retry_after = self.poll_limiter.allow(self.username)
+        if not allowed:
+            self.context['cs_handler'] = 'conditional_response'
+            self.context['content_type'] = "application/json"
+            self.context['response'] = ""
+            self.context['response_status'] = ("429", "Too Many Requests")
+            self.context['response_headers'] = {'Retry-After': str(int(retry_after) + 1),
+                                                'X-Next-Poll-Ms': str(max(int(retry_after * 1000), self.POLL_LIVE_MS))}
+            return ""
+        try:
+            with open(self.msg_file(staff=self.is_staff)) as ifp:
+                html = ifp.read()
+        except OSError:
+            html = json.dumps({})
+        live = self.is_live(html)
+        self.context['cs_handler'] = 'conditional_response'
+        self.context['content_type'] = "application/json"
+        self.context['response'] = html
+        self.context['response_headers'] = {'ETag': '"%s"' % hashlib.sha1(html.encode("utf-8")).hexdigest(),
+                                            'Cache-Control': 'no-cache' if live else 'max-age=%d' % self.IDLE_MAX_AGE,
+                                            'X-Next-Poll-Ms': str(self.POLL_LIVE_MS if live else self.POLL_IDLE_MS)}
+        return ""
+
+    def is_live(self, msgjson):
+        '''
+        Return True if the published message msgjson has not yet expired
+        '''
+        try:
+            return float(json.loads(msgjson).get("expires") or 0) > time.time()
+        except (ValueError, TypeError, AttributeError):
+            return False
+
+    def ajax_stats(self):
+        '''
+        Return action and csm_cslog call counts and latency histograms, in the Prometheus text format
+        '''
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "text/plain; version=0.0.4"
+        self.context['response'] = self.metrics.prometheus_text()
+        return ""
+
+    def msg_file(self, staff=False):
+        '''
+        Return filename of the published message for staff, or for everyone
+        '''
+        return os.path.expanduser(self.STAFF_MSG_FILE if staff else self.MSG_FILE)
+
+    def get_message(self, get_all=False):
+        '''
+        Get current message (if all==False), from the published file for this user; else return all messages from the log
+        '''
+        if get_all:
+            return self.cslog.read_log(self.course, [self.db_name], "all")
+        try:
+            with open(self.msg_file(staff=self.is_staff)) as ifp:
+                return json.load(ifp)
+        except (OSError, ValueError):
+            return {}
+
+    def save_message(self, msg=None, audience=None, write_to_file=True, courses=None):
+        '''
+        Save message to the logs of each of courses (default: just this course), and return dict
+        of course -> None if saved, or the error message if saving failed.  Several courses
+        are saved concurrently, by a pool of up to SAVE_WORKERS threads.
+
+        if write_to_file then also publish JSON to the message files (accessed directly by nginx, to reduce catsoop load);
+        these are shared by all courses on the site, so they are written once.
+
+        A lock file serializes concurrent saves, so that versions and history seq numbers increase monotonically.
+        '''
+        courses = list(dict.fromkeys(courses or [self.course]))
+        with self.save_lock():
+            version = self.get_published_version() + 1
+            data = {'msg': msg, 'creator': self.username, 'audience': audience, 'datetime': str(datetime.datetime.now()),
+                    'expires': round(time.time() + self.MESSAGE_TTL, 3), 'version': version}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.SAVE_WORKERS, len(courses))) as pool:
+                futures = {course: pool.submit(self.save_course_message, course, dict(data)) for course in courses}
+            results = {}
+            saved = []
+            for course, future in futures.items():
+                try:
+                    saved.append(future.result())
+                    results[course] = None
+                except Exception as err:
+                    LOGGER.error("[BroadcastMessage] failed to save message in course=%s, err=%s" % (course, err))
+                    results[course] = str(err) or err.__class__.__name__
+            if write_to_file and saved:
+                self.publish(saved[0])
+        if write_to_file and saved:
+            self.notify_push()
+        return results
+
+    def save_course_message(self, course, data):
+        '''
+        Save message data to course's log and history logs, numbering it with the course's next history seq
+        number; must hold the save lock.  Returns the saved data.
+        '''
+        data['seq'] = self.get_history_count(locked=True, course=course) + 1
+        self.cslog.update_log(course, [self.db_name], "all", data)
+        self.append_history(data, course=course)
+        LOGGER.info("[BroadcastMessage] saved data=%s in course=%s for username=%s!" % (data, course, self.username))
+        return data
+
+    def save_lock(self):
+        '''
+        Return the save lock file, opened and exclusively locked; use in a with statement, which releases the lock
+        '''
+        lockfp = open(os.path.expanduser(self.MSG_FILE) + ".lock", 'w')
+        fcntl.flock(lockfp, fcntl.LOCK_EX)
+        return lockfp
+
+    def get_history_count(self, locked=False, course=None):
+        '''
+        Return number of messages in the history logs of course (default: this course).  If there is
+        no history count yet, then build the history logs from the "all" log first (this needs the
+        save lock, which is taken here unless locked is True).
+        '''
+        course = course or self.course
+        data = self.cslog.most_recent(course, [self.db_name], "history_count", lock=False)
+        if data is not None:
+            return data.get("count", 0)
+        if not locked:
+            with self.save_lock():
+                return self.get_history_count(locked=True, course=course)
+        entries = self.cslog.read_log(course, [self.db_name], "all")
+        for seq, entry in enumerate(entries, 1):
+            entry['seq'] = seq
+            self.cslog.update_log(course, [self.db_name], self.history_logname(seq), entry)
+        self.cslog.overwrite_log(course, [self.db_name], "history_count", {'count': len(entries)})
+        LOGGER.info("[BroadcastMessage] built history logs from %d messages" % len(entries))
+        return len(entries)
+
+    def history_logname(self, seq):
+        return "history.%d" % ((seq - 1) // self.HISTORY_BUCKET)
+
+    def append_history(self, data, course=None):
+        '''
+        Add message data (numbered with data['seq']) to the history logs of course (default: this course); must hold the save lock
+        '''
+        course = course or self.course
+        self.cslog.update_log(course, [self.db_name], self.history_logname(data['seq']), data)
+        self.cslog.overwrite_log(course, [self.db_name], "history_count", {'count': data['seq']})
+
+    def get_history(self, before=None, n=None):
+        '''
+        Return list of up to n messages (default HISTORY_PAGE) numbered below before (default: newest), from recent to oldest
+        '''
+        n = n or self.HISTORY_PAGE
+        count = self.get_history_count()
+        last = min(before - 1, count) if before else count
+        first = max(last - n + 1, 1)
+        entries = []
+        for logname in dict.fromkeys(self.history_logname(seq) for seq in range(first, last + 1)):
+            entries += [x for x in self.cslog.read_log(self.course, [self.db_name], logname, lock=False)
+                        if first <= x.get('seq', 0) <= last]
+        return entries[::-1]
+
+    def get_published_version(self):
+        '''
+        Return version of the latest published message (0 if none)
+        '''
+        version = 0
+        for fn in [self.msg_file(staff=True), self.msg_file()]:	# MSG_FILE alone was published before STAFF_MSG_FILE existed
+            try:
+                with open(fn) as ifp:
+                    version = max(version, int(json.load(ifp).get("version", 0)))
+            except (OSError, ValueError, TypeError, AttributeError):
+                pass
+        return version
+
+    def publish(self, data):
+        '''
+        Publish message data to STAFF_MSG_FILE, and also to MSG_FILE unless it is for staff only
+        '''
+        self.write_msg_file(self.msg_file(staff=True), data)
+        if data.get("audience") != "staff":
+            self.write_msg_file(self.msg_file(), data)
+
+    def write_msg_file(self, fn, data):
+        '''
+        Atomically replace file fn with JSON of data: write a temporary file in the same directory, then rename
+        '''
+        fd, tmpfn = tempfile.mkstemp(dir=os.path.dirname(fn), suffix=".tmp")
+        with os.fdopen(fd, 'w') as ofp:
+            ofp.write(json.dumps(data))
+        os.chmod(tmpfn, 0o644)
+        os.replace(tmpfn, fn)
+
+    def notify_push(self):
+        '''
+        Tell the broadcast_push service (if running) to send the newly published message to its clients
+        '''
+        if not self.PUSH_NOTIFY_URL:
+            return
+        try:
+            req = urllib.request.Request(self.PUSH_NOTIFY_URL, data=b"", method="POST")
+            urllib.request.urlopen(req, timeout=0.5).close()
+        except OSError as err:
+            LOGGER.info("[BroadcastMessage] could not notify broadcast_push service at %s, err=%s" % (self.PUSH_NOTIFY_URL, err))
+
+    def process_form_save(self, form_data):
+        '''
+        Save data from form
+        '''
+        msg = form_data.get("msg")
+        everyone = form_data.get("everyone", "staff")
+        audience = everyone
+        if audience=="on":
+            audience = "all"
+        courses = [self.course] + [c for c in self.COURSES if c != self.course and form_data.get("course_%s" % c)]
+        if msg:
+            results = self.save_message(msg, audience, courses=courses)
+            if not any(results.values()):
+                html = "<font color='green'>Message broadcast!</font>"
+            else:
+                html = "".join("<p><font color='%s'>%s: %s</font></p>" % ("red" if err else "green", course,
+                                                                           "failed (%s)" % err if err else "saved")
+                               for course, err in results.items())
+        else:
+            html = "<font color='red'>Empty message: nothing done</font>"
+        return self.show_form(extra_html=html)
+
+    def show_course_choices(self):
+        '''
+        Return html of checkboxes for also saving the message in the other COURSES (if any)
+        '''
+        others = [c for c in self.COURSES if c != self.course]
+        if not others:
+            return ""
+        boxes = ['<label><input type="checkbox" name="course_%s"> %s</label>' % (c, c) for c in others]
+        return "<p>Also save in courses: %s</p>" % " ".join(boxes)
+
+    def show_form(self, extra_html="", before=None):
+        '''
+        Show input form asking for message
+        Also show one page of old messages (those numbered below before, if given), with links to older/newest pages
+        '''
+        try:
+            before = int(before) if before else None
+        except ValueError:
+            before = None
+        data = self.get_history(before)
+        html = ["<p>Fill in this form to immediately broadcast a message to users currently connected to the course's sytem.  ",
+                "Select 'staff only' to limit the message to just staff, or 'everyone' to send to all users</p>",
+                "<form method='POST' action='%s'>" % self.my_url,
+                '''<p>New (short) message to broadcast: <input type="text" size=120 value="" name="msg"></input></p>''',
+                """<p>Send to staff only <label class="switch">
+                    <input type="checkbox" name="everyone">
+                      <span class="slider round"></span>
+                   </label> Broadcast to everyone: students and staff</p>
+                """,
+                self.show_course_choices(),
+                '''<p><input type="submit" name="Broadcast"></input></p>''',
+                "</form>",
+                extra_html,
+                "<div>",
+                "<table><tr><th>Date</th><th>Author</th><th>Audience</th><th>Message</th></tr>"]
+        html.extend("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>" % (msginfo.get("datetime"),
+                                                                             msginfo.get("creator"),
+                                                                             msginfo.get("audience"),
+                                                                             msginfo.get("msg"))
+                    for msginfo in data)
+        html.append("</table>")
+        links = []
+        if before:
+            links.append("<a href='%s'>newest</a>" % self.my_url)
+        if data and data[-1].get('seq', 1) > 1:
+            links.append("<a href='%s?before=%d'>older</a>" % (self.my_url, data[-1]['seq']))
+        html.append("<p>%s</p>" % " | ".join(links))
+        html.append("</div>")
+
+        return "".join(html)
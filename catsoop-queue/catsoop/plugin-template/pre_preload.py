@@ -10,3 +10,54 @@ queue_page = False
 # The default value for the queue_room is None to force errors if unset.  For a single-room setup,
 # you can change this to be the name of your room.
 queue_room = ${queue_room}
+
+# Set this to True to cache each user's scores on a page (in cs_data_root/_queue_cache) when
+# deciding which questions get queue buttons, instead of reading the page's problem state log on
+# every page load.  A cache entry is used only while the problem state log's mtime and size are
+# unchanged (so new scores show up as soon as they are logged, even when grading finishes after
+# the submission), and for at most queue_score_cache_ttl seconds.  This needs csm_cslog to keep
+# logs in files (the filesystem backend); with other backends the scores are always read.
+queue_score_cache = False
+queue_score_cache_ttl = 300
+
+# How post_handle.py adds the "Ask for Help/Checkoff" buttons: 'string' inserts them into the page
+# source directly; 'soup' parses and re-serializes the page with BeautifulSoup (much slower).
+queue_button_injection = 'string'
+
+# Tags for the fingerprinted broadcast.js and broadcast.css bundles, prebuilt by
+# scripts/make_catsoop.py; used by cs_add_broadcast_messaging_js in the course preload.py.
+broadcast_asset_tags = ${broadcast_asset_tags}
+
+# Set queue_profile_rate to the fraction of page loads (e.g. 0.01) to profile with cProfile, from
+# post_auth to the end of post_handle (or, for ajax responses from remote_queue and broadcast, to
+# the end of their dispatch).  Staff can also profile one page load by adding cs_profile to its
+# query string.  Each profile is saved as a pstats file in queue_profile_dir (by default
+# cs_data_root/_queue_profiles); scripts/profile_report.py merges them into a hot-path report.
+queue_profile_rate = 0
+queue_profile_dir = None
+
+# The plugin's code is in queue_plugin.py, imported once per worker process (the other hooks just
+# call into it).  Its module name includes a hash of its contents, computed by
+# scripts/make_catsoop.py, so a regenerated plugin is picked up without restarting CAT-SOOP.  The
+# loader is a function (deleted once called) so that only queue_plugin is left in the page's
+# namespace.
+def queue_plugin_load(name, data_root, course):
+    import sys
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    import importlib.util
+    import os
+    filename = os.path.join(data_root, 'courses', course, '__PLUGINS__', ${queue_plugin_name}, 'queue_plugin.py')
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Drop the versions of this plugin loaded before it was regenerated (other courses' plugins,
+    # from other files, are kept)
+    for other, old in list(sys.modules.items()):
+        if other.startswith('queue_plugin_') and other != name and getattr(old, '__file__', None) == filename:
+            sys.modules.pop(other, None)
+    return sys.modules.setdefault(name, module)
+
+queue_plugin = queue_plugin_load(${queue_module}, cs_data_root, cs_course)
+del queue_plugin_load
@@ -0,0 +1,342 @@
+# The queue plugin's code, imported once per CAT-SOOP worker process
+#
+# CAT-SOOP runs the plugin's hooks (pre_preload.py, post_auth.py, post_load.py, pre_handle.py and
+# post_handle.py) as source on every request.  They are thin shims: pre_preload.py imports this
+# module (generated by scripts/make_catsoop.py, with the queue's URL and asset tags filled in), and
+# the other hooks call its functions with the request's context, which they read and update.  So
+# the definitions and templates below are built once per process, not on every page load, and
+# heavy dependencies (BeautifulSoup, cProfile) are only imported when first used.
+
+import html
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+LOGGER = logging.getLogger('cs')
+
+STAFF_ROLES = ['Admin', 'TA', 'UTA', 'LA']
+STUDENT_STAFF_ROLES = ['SLA']
+
+#-----------------------------------------------------------------------------
+# post_auth: roles, and profiling of sampled page loads
+
+def post_auth(context):
+    # Determine whether the current user has a staff role or a combined student+staff role, and
+    # start profiling this page load if it is sampled (see queue_profile_rate in pre_preload.py)
+    role = context.get('cs_user_info', {}).get('role', None)
+    context['queue_is_staff'] = role in STAFF_ROLES
+    context['queue_is_student_staff'] = role in STUDENT_STAFF_ROLES
+    context['queue_profile_finish'] = lambda: profile_finish(context)
+    profile_start(context)
+
+def profile_start(context):
+    # a profile left running by an earlier page load on this thread (which ended in an error) is dropped
+    thread = threading.current_thread()
+    if getattr(thread, 'queue_profiler', None) is not None:
+        thread.queue_profiler.disable()
+        thread.queue_profiler = None
+
+    rate = context.get('queue_profile_rate')
+    if (rate and random.random() < rate) or (context['queue_is_staff'] and 'cs_profile' in context.get('cs_form', {})):
+        import cProfile
+        thread.queue_profiler = cProfile.Profile()
+        try:
+            thread.queue_profiler.enable()
+        except ValueError:	# another profiler is active
+            thread.queue_profiler = None
+
+def profile_finish(context):
+    # Stop profiling this page load, and save the profile as a pstats file in queue_profile_dir
+    thread = threading.current_thread()
+    profiler = getattr(thread, 'queue_profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    thread.queue_profiler = None
+    page = '.'.join(context.get('cs_path_info', [])).replace(os.sep, '_') or 'root'
+    directory = context.get('queue_profile_dir') or os.path.join(context['cs_data_root'], '_queue_profiles')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, '{}-{}-{}.pstats'.format(
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(), page)))
+    except OSError as err:
+        LOGGER.error('[queue] failed to save profile of {}: {}'.format(page, err))
+
+#-----------------------------------------------------------------------------
+# post_load: add the queue script and stylesheet to the page
+
+URL_ROOT = ${queue_url_root}
+
+# Tags for the fingerprinted queue.css and queue.js bundles, prebuilt by scripts/make_catsoop.py
+CSS_TAGS = ${queue_css_tags}
+JS_TAGS = ${queue_js_tags}
+
+QUEUE_SETTINGS = '''
+    <script>
+    catsoop.plugins.queue = {{
+        url_root: '{url_root}',
+        is_staff: {is_staff},
+        container: {container},
+        view: '{view}',
+        room: '{room}',
+    }};
+    </script>
+    '''
+
+def post_load(context):
+    if not context.get('queue_enable'):
+        return
+    form = context.get('cs_form', {})
+    if context.get('queue_page'):
+        if context['queue_is_staff']:
+            load_staff_queue = form.get('queue_view', 'staff') != 'student'
+        elif context['queue_is_student_staff']:
+            load_staff_queue = form.get('queue_view', 'student') == 'staff'
+        else:
+            load_staff_queue = False
+
+        view = 'staff_view' if load_staff_queue else 'student_static'
+    else:
+        view = 'student_popup'
+
+    context['cs_scripts'] += CSS_TAGS
+    context['cs_content'] += JS_TAGS + QUEUE_SETTINGS.format(
+        url_root = URL_ROOT,
+        is_staff = 'true' if context['queue_is_staff'] or context['queue_is_student_staff'] else 'false',
+        container = '"body"' if view == 'student_popup' else '"#queue-container"',
+        view = view,
+        room = context.get('queue_room') or '',
+    )
+
+#-----------------------------------------------------------------------------
+# pre_handle: collect question info in order to create the "Ask for Help/Checkoff" buttons
+
+def score_cache_file(context, username, path):
+    return os.path.join(
+        context['cs_data_root'],
+        '_queue_cache',
+        context['cs_course'],
+        urllib.parse.quote(username, safe=''),
+        urllib.parse.quote('.'.join(path), safe='') + '.json',
+    )
+
+def log_stat(context, username, path):
+    # Return [mtime, size] of the page's problem state log (named as in load_scores), or None if
+    # csm_cslog does not keep logs in files
+    get_log_filename = getattr(context['csm_cslog'], 'get_log_filename', None)
+    if get_log_filename is None:
+        return None
+    try:
+        st = os.stat(get_log_filename(context['cs_course'], username, '.'.join(path + ['problemstate'])))
+    except OSError:
+        return [0, 0]
+    return [st.st_mtime_ns, st.st_size]
+
+def load_scores(context, username, path):
+    # Read the problem state for this page once, and return its scores.  If queue_score_cache is
+    # set, the scores are cached in a small file, along with the mtime and size of the problem
+    # state log they were read from.  The entry is used only while the log is unchanged (so that
+    # scores from submissions, and from grading which finishes later, show up at once), and for
+    # at most queue_score_cache_ttl seconds.
+    stat = log_stat(context, username, path) if context.get('queue_score_cache') else None
+    cache_file = score_cache_file(context, username, path) if stat is not None else None
+    if cache_file is not None:
+        try:
+            if time.time() - os.stat(cache_file).st_mtime < context['queue_score_cache_ttl']:
+                with open(cache_file) as f:
+                    entry = json.load(f)
+                if entry.get('log') == stat:
+                    return entry['scores']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    log = context['csm_cslog'].most_recent(
+        context['cs_course'],
+        username,
+        '.'.join(path + ['problemstate']),
+        {},
+    )
+    scores = log.get('scores', {})
+
+    if cache_file is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump({'log': stat, 'scores': scores}, f)
+            os.replace(tmp_file, cache_file)
+        except (OSError, TypeError, ValueError):
+            pass
+    return scores
+
+def pre_handle(context):
+    if not context.get('queue_enable'):
+        return
+    questions = context['queue_questions'] = {}
+    scores = None
+    for problem in context.get('cs_problem_spec', []):
+        if type(problem) != tuple:
+            continue
+
+        qtype, qcontext = problem
+        if scores is None:
+            scores = load_scores(
+                context,
+                context.get('cs_user_info', {}).get('username', 'None'),
+                context['cs_path_info'][1:],
+            )
+        score = scores.get(qcontext['csq_name'], 0)
+        if score != 1:
+            questions[qcontext['csq_name']] = (qtype, qcontext)
+
+#-----------------------------------------------------------------------------
+# post_handle: add the "Ask for Help/Checkoff" buttons for any discovered questions
+#
+# By default (queue_button_injection = 'string') the buttons are inserted into the page source
+# right after each question's "<name>_buttons" element, which is found by scanning the source.
+# With queue_button_injection = 'soup', the whole page is instead parsed with BeautifulSoup and
+# re-serialized, which is much slower on large pages (see scripts/bench_queue_buttons.py).
+
+ADD_TO_QUEUE = '''\
+queue.add('{type}', {{
+  location: queue.get('location'),
+  assignment: {{
+    name: '{csq_name}',
+    page: catsoop.this_path,
+    path: catsoop.path_info,
+    display_name: '{csq_display_name}',
+  }},
+}})
+'''
+
+TABLENUMBER_MODAL = '''\
+!queue.get('location') ?
+catsoop.modal(
+    "Enter Table Number",
+    "Please enter your table number:",
+    true,
+    true).then(function(text) {{
+        if(typeof text.value !== 'undefined'){{
+            queue.set('location', text.value);
+            ''' + ADD_TO_QUEUE + '''
+            queue.set('_visible', true);
+        }}
+    }}) : (''' + ADD_TO_QUEUE + ''', queue.set('_visible', true))'''
+
+def button_types(qtype):
+    types = [('help', 'Ask for Help')]
+    if qtype['qtype'] == 'checkoff':
+        types.append(('checkoff', 'Ask for Checkoff'))
+    return types
+
+def buttons_tag(soup, qtype, context):
+    buttons = soup.new_tag('span')
+    buttons['id'] = '{}_queue_buttons'.format(context['csq_name'])
+
+    for type_, text in button_types(qtype):
+        button = soup.new_tag('button')
+        button['class'] = ['btn', 'btn-catsoop']
+        button.string = text
+        button['onclick'] = TABLENUMBER_MODAL.format(
+            type = type_,
+            **context,
+        )
+        buttons.append(' ')
+        buttons.append(button)
+
+    return buttons
+
+def buttons_html(qtype, context):
+    buttons = ['<span id="{}">'.format(html.escape('{}_queue_buttons'.format(context['csq_name'])))]
+    for type_, text in button_types(qtype):
+        onclick = TABLENUMBER_MODAL.format(
+            type = type_,
+            **context,
+        )
+        buttons.append(' <button class="btn btn-catsoop" onclick="{}">{}</button>'.format(
+            html.escape(onclick),
+            text,
+        ))
+    buttons.append('</span>')
+    return ''.join(buttons)
+
+# the id attribute must follow whitespace or a quote, so that e.g. data-id="..." is not taken for it
+ELEMENT_WITH_ID = re.compile(r"""<([a-zA-Z][a-zA-Z0-9]*)\b[^>]*?[\s"']id\s*=\s*["']([^"']*)["'][^>]*>""")
+
+def element_end(content, opening):
+    # Return the index just past the closing tag matching the given opening tag match, or None
+    tag = re.compile(r'<(/?){}\b[^>]*>'.format(re.escape(opening.group(1))), re.IGNORECASE)
+    depth = 1
+    for t in tag.finditer(content, opening.end()):
+        depth += -1 if t.group(1) else 1
+        if depth == 0:
+            return t.end()
+    return None
+
+def insert_buttons(content, questions):
+    # Insert buttons after each question's "<name>_buttons" element, without parsing the page.
+    # Elements are found in a single scan of the page's tags.
+    wanted = set()
+    for name in questions:
+        wanted.add('cs_qdiv_{}'.format(name))
+        wanted.add('{}_buttons'.format(name))
+    openings = {}
+    for match in ELEMENT_WITH_ID.finditer(content):
+        if match.group(2) in wanted:
+            openings.setdefault(match.group(2), match)
+
+    insertions = []
+    for name, (qtype, context) in questions.items():
+        qdiv = openings.get('cs_qdiv_{}'.format(name))
+        if qdiv is None: continue
+
+        # as in 'soup' mode, the buttons element must be inside the question's div
+        buttons = openings.get('{}_buttons'.format(name))
+        if buttons is None or buttons.start() < qdiv.start(): continue
+        qdiv_end = element_end(content, qdiv)
+        if qdiv_end is None or buttons.start() >= qdiv_end: continue
+
+        end = element_end(content, buttons)
+        if end is None: continue
+
+        insertions.append((end, buttons_html(qtype, context)))
+
+    pieces = []
+    last = 0
+    for end, buttons in sorted(insertions, key=lambda x: x[0]):
+        pieces.append(content[last:end])
+        pieces.append(buttons)
+        last = end
+    pieces.append(content[last:])
+    return ''.join(pieces)
+
+def insert_buttons_soup(content, questions):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content)
+
+    for name, (qtype, context) in questions.items():
+        qdiv = soup.find(id='cs_qdiv_{}'.format(name))
+        if qdiv is None: continue
+
+        buttons = qdiv.find(id='{}_buttons'.format(name))
+        if buttons is None: continue
+
+        buttons.insert_after(buttons_tag(soup, qtype, context))
+
+    return str(soup)
+
+def post_handle(context):
+    questions = context.get('queue_questions')
+    if context.get('queue_enable') and questions:
+        if context.get('queue_button_injection') == 'soup':
+            context['cs_content'] = insert_buttons_soup(context['cs_content'], questions)
+        else:
+            context['cs_content'] = insert_buttons(context['cs_content'], questions)
+
+    # Save the profile of this page load, if it is being profiled (see post_auth)
+    profile_finish(context)
@@ -27,7 +27,8 @@ const params = {
         // CAT-SOOP instance with '/cs_util/api' appended to it.
         API_ROOT: 'https://YOUR_SERVER/_util/api',
 
-        // The name of the queue plugin in your __PLUGINS__ directory.
+        // The name of the queue plugin in your __PLUGINS__ directory.  The plugin's hooks import
+        // its code (queue_plugin.py) from there, so this must match the directory's name.
         PLUGIN_NAME: 'queue',
 
         // These directories will be run through Python's string.Template and formatted by
@@ -37,6 +38,13 @@ const params = {
         ROOM_SELECTION_TEMPLATE: 'catsoop/room-selection-template',
     },
 
+    // The catsoop remote_queue page publishes staff video urls to the queue server when they are
+    // saved (set RemoteQueue.URL_NOTIFY), so that claimed entries can carry their claimant's url.
+    // It can post to http://127.0.0.1:PORT/remote_urls, or to a unix socket at SOCKET, if set.
+    REMOTE_URLS: {
+        SOCKET: null,
+    },
+
     // Set this to true to enable the staff check-in feature.  Make sure to enable SHOW_STAFF_LIST
     // in www_params.js after you enable this.
     STAFF_CHECK_IN_REQUIRED: false,
@@ -49,6 +57,16 @@ const params = {
     // A room name can't start with a '.' or '_' character or contain '/'.
     ROOMS: ['default'],
 
+    // Fingerprinted (content-hashed), minified and gzipped bundles of the queue and broadcast
+    // scripts and stylesheets are built into DESTINATION by `scripts/make_catsoop.py`, and served
+    // under URL_ROOT/assets.  QUEUE_SOURCE is the built www directory, and BROADCAST_SOURCE is
+    // the directory containing broadcast.js and broadcast.css.
+    ASSETS: {
+        DESTINATION: 'dist/www/assets',
+        QUEUE_SOURCE: 'dist/www',
+        BROADCAST_SOURCE: '../__STATIC__',
+    },
+
     // Set this to true if you'd like the logs printed to the console
     PRINT_LOGS: false,
 
@@ -88,7 +88,10 @@ gulp.task('build-www', ['build-www-js'], () => {
             .pipe(gulp.dest('dist/www/audio')),
 
         gulp.src('www/scss/**/*.scss')
-            .pipe(sass({includePaths: [path.join(__dirname, 'node_modules')]}).on('error', sass.logError))
+            .pipe(sass({
+                includePaths: [path.join(__dirname, 'node_modules')],
+                outputStyle: 'compressed',
+            }).on('error', sass.logError))
             .pipe(autoprefixer({browsers: ['last 2 versions']}))
             .pipe(gulp.dest('dist/www/css')),
 
@@ -114,7 +117,9 @@ gulp.task('build-server', () => {
         .pipe(gulp.dest('dist/server'));
 });
 
-gulp.task('build-catsoop', ['clean-catsoop'], () => {
+// make_catsoop.py also fingerprints the built www assets, so it runs after build-www.  It only
+// rewrites files that changed (and removes stale ones), so dist/catsoop is not cleaned first.
+gulp.task('build-catsoop', ['build-www'], () => {
     return new Promise((resolve, reject) => {
         spawn('./scripts/make_catsoop.py', [
             JSON.stringify(params),
@@ -208,7 +213,7 @@ gulp.task('reload-config', () => {
 });
 
 gulp.task('start', ['clean', 'build', 'run-server'], () => {
-    gulp.watch(['www/**/*', 'imports/*'], ['build-www']);
+    gulp.watch(['www/**/*', 'imports/*', '../__STATIC__/*'], ['build-catsoop']);
     gulp.watch(['server/*'], ['run-server']);
     gulp.watch(['catsoop/*'], ['build-catsoop']);
     gulp.watch(['config/*'], ['reload-config', 'build', 'run-server']);
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+'''
+Benchmark the two ways the queue plugin's post_handle (in catsoop/plugin-template/queue_plugin.py)
+can add the "Ask for Help/Checkoff" buttons to a page: scanning the page source ('string', the
+default) and parsing and re-serializing the whole page with BeautifulSoup ('soup').
+
+Pages are generated to look like CAT-SOOP's rendering of a lab page, with the given numbers of
+questions and some prose around each one.  For each page, the script checks that both modes insert
+the same buttons, then reports the page size and the time per call of each mode.
+
+    scripts/bench_queue_buttons.py [--questions 5,30,100] [--prose 4000] [--repeat 5]
+
+Requires BeautifulSoup (pip install beautifulsoup4).
+'''
+
+import argparse
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+# the plugin is loaded as the tests load it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test'))
+from test_queue_plugin import load_plugin
+
+QUESTION = '''
+<p>{prose}</p>
+<!--START question {name} --><section aria-label="Question">
+<div class="question question-{qtype}" id="cs_qdiv_{name}" style="position: static">
+<div id="{name}_rendered_question">
+
+<div id="catsoop_preamble_{name}"></div>
+<div id="catsoop_prompt_{name}" style="display: inline;"><p>Question {name}: what is <code>f(x)</code>?</p></div><input type="text" id="{name}" name="{name}" value="" size="50" />
+</div><div>
+<span id="{name}_buttons"><button id="{name}_submit" class="submit btn btn-catsoop" onclick="catsoop.submit('{name}');">Submit</button><button id="{name}_check" class="check btn btn-catsoop" onclick="catsoop.check('{name}');">Check Syntax</button></span>
+<span id="{name}_loading_wrapper" role="status">
+<span id="{name}_loading" style="display:none;"><img src="loading.gif" class="catsoop-darkmode-invert"/><span class="screenreader-only-clip">Loading...</span></span>
+</span>
+<span id="{name}_score_display" role="status"></span>
+<div id="{name}_nsubmits_left" class="nsubmits_left" role="status">You have infinitely many submissions remaining.</div>
+</div>
+<div id="{name}_message" aria-live="polite"></div>
+</div></section><!--END question {name} -->
+'''
+
+PROSE = 'Consider the following <b>procedure</b>, and <a href="#">the notes</a> on it. '
+
+def make_page(nquestions, prose_chars):
+    prose = (PROSE * (prose_chars // len(PROSE) + 1))[:prose_chars].rsplit(' ', 1)[0]
+    questions = {}
+    body = ['<div id="cs_page_content">']
+    for i in range(nquestions):
+        name = 'q{:03d}'.format(i)
+        qtype = 'checkoff' if i % 5 == 4 else 'pythoncode'
+        body.append(QUESTION.format(name=name, qtype=qtype, prose=prose))
+        questions[name] = ({'qtype': qtype}, {'csq_name': name, 'csq_display_name': 'Question {}'.format(i)})
+    body.append('</div>')
+    return ''.join(body), questions
+
+def run(plugin, mode, content, questions):
+    context = {
+        'queue_enable': True,
+        'queue_questions': questions,
+        'queue_button_injection': mode,
+        'cs_content': content,
+    }
+    plugin.post_handle(context)
+    return context['cs_content']
+
+def inserted_buttons(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    return [str(span) for span in soup.find_all(id=lambda x: x and x.endswith('_queue_buttons'))]
+
+def time_per_call(plugin, mode, content, questions, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(plugin, mode, content, questions)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default='5,30,100', help='comma separated numbers of questions per page')
+    parser.add_argument('--prose', type=int, default=4000, help='characters of prose before each question')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement (the fastest is reported)')
+    args = parser.parse_args()
+
+    plugin = load_plugin()
+    print('{:>9} {:>10} {:>12} {:>12} {:>8}'.format('questions', 'page size', 'string (ms)', 'soup (ms)', 'speedup'))
+    for nquestions in [int(x) for x in args.questions.split(',')]:
+        content, questions = make_page(nquestions, args.prose)
+
+        expected = inserted_buttons(run(plugin, 'soup', content, questions))
+        got = inserted_buttons(run(plugin, 'string', content, questions))
+        if got != expected or len(got) != nquestions:
+            raise SystemExit('string and soup modes inserted different buttons for {} questions'.format(nquestions))
+
+        t_string = time_per_call(plugin, 'string', content, questions, args.repeat)
+        t_soup = time_per_call(plugin, 'soup', content, questions, args.repeat)
+        print('{:>9} {:>9}K {:>12.2f} {:>12.2f} {:>7.0f}x'.format(
+            nquestions, len(content) // 1024, t_string * 1000, t_soup * 1000, t_soup / t_string))
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,30 @@
 #!/usr/bin/env python3
+#
+# Generate the CAT-SOOP plugin and room pages from their templates:
+#
+#     scripts/make_catsoop.py [--dry-run] PARAMS_JSON DESTINATION
+#
+# The room templates are read once for all rooms, and only outputs whose contents changed are
+# rewritten (so unchanged files keep their mtimes, and CAT-SOOP's cached compiled pages stay
+# valid).  The hash of each output is recorded in DESTINATION/.manifest.json; outputs which are no longer
+# generated (e.g. for a removed room) are deleted.  With --dry-run, nothing is written, and a
+# diff of what would change is printed instead.
+#
+# The plugin's code is rendered into an importable module, plugin/queue_plugin.py, which the hooks
+# import once per CAT-SOOP worker (under a name including its content hash) and call into.
 
+import argparse
+import difflib
+import gzip
+import hashlib
 import json
 import os
 import re
 import string
 import sys
 
+MANIFEST = '.manifest.json'
+
 def exclude(filename):
     return filename.endswith('~') or filename.endswith('.swp') or re.match('^#.*#$', filename)
 
@@ -20,54 +39,252 @@ def mkdir(d):
         except OSError:
             error('{} already exists and is not a directory'.format(d))
 
-def build_templates(src, dest, context):
-    mkdir(dest)
+def load_templates(src):
+    # Return a list of (path relative to src, string.Template) for the templates in src
+    loaded = []
     for parent_dir, child_dirs, templates in os.walk(src):
         for template in templates:
             if exclude(template): continue
             template_src = os.path.join(parent_dir, template)
             with open(template_src) as f:
-                template_content = string.Template(f.read())
-            template_dest = os.path.join(dest, os.path.relpath(template_src, src))
-            mkdir(os.path.dirname(template_dest))
-            with open(template_dest, 'w') as f:
-                f.write(template_content.substitute(**context))
+                loaded.append((os.path.relpath(template_src, src), string.Template(f.read())))
+    return loaded
 
+def render_templates(src, dest, context, templates=None):
+    # Return a dict mapping each output filename to its contents; templates, if given, are the
+    # already loaded templates of src
+    outputs = {}
+    for relpath, template_content in templates or load_templates(src):
+        outputs[os.path.join(dest, relpath)] = template_content.substitute(**context)
+    return outputs
 
-params, destination = sys.argv[1:]
-params = json.loads(params)
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
-room_destination = os.path.join(destination, 'pages')
-plugin_destination = os.path.join(destination, 'plugin')
+def read_manifest(destination):
+    try:
+        with open(os.path.join(destination, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
+def read_output(filename):
+    try:
+        with open(filename) as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
 
-# Make plugin
-build_templates(params['CATSOOP']['PLUGIN_TEMPLATE'], plugin_destination, {
-        'queue_room': repr(params['ROOMS'][0] if len(params['ROOMS']) == 1 else None),
-        'queue_url_root': repr(params['URL_ROOT']),
-})
+def write_outputs(destination, outputs, dry_run=False):
+    # Write the outputs that differ from what is on disk, delete stale outputs listed in the old
+    # manifest, and record the new manifest.  With dry_run, print a diff instead.
+    old_manifest = read_manifest(destination)
+    manifest = {}
+    changed = 0
+    for filename, content in sorted(outputs.items()):
+        relname = os.path.relpath(filename, destination)
+        manifest[relname] = content_hash(content)
+        if old_manifest.get(relname) == manifest[relname] and os.path.isfile(filename):
+            continue
+        old_content = read_output(filename)
+        if old_content == content:
+            continue
+        changed += 1
+        if dry_run:
+            sys.stdout.writelines(difflib.unified_diff(
+                (old_content or '').splitlines(True),
+                content.splitlines(True),
+                'a/' + relname,
+                'b/' + relname,
+            ))
+            continue
+        mkdir(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
 
+    stale = sorted(set(old_manifest) - set(manifest))
+    for relname in stale:
+        if dry_run:
+            print('Only in old output: {}'.format(relname))
+            continue
+        try:
+            os.unlink(os.path.join(destination, relname))
+        except FileNotFoundError:
+            pass
+        # remove directories left empty, e.g. for a removed room
+        parent = os.path.dirname(relname)
+        while parent:
+            try:
+                os.rmdir(os.path.join(destination, parent))
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
 
-if not params['ROOMS']:
-    error('No room names specified')
+    if not dry_run:
+        mkdir(destination)
+        with open(os.path.join(destination, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+    print('{}: {} of {} files {}, {} stale files {}'.format(
+        destination,
+        changed,
+        len(outputs),
+        'would change' if dry_run else 'changed',
+        len(stale),
+        'would be removed' if dry_run else 'removed',
+    ))
 
-# In the case of only one room, there's no need for a root page, so this just
-# makes the one room page and exits
-if len(params['ROOMS']) == 1:
-    build_templates(params['CATSOOP']['ROOM_TEMPLATE'], room_destination, {
-            'queue_room_name': params['ROOMS'][0],
-            'queue_plugin_name': params['CATSOOP']['PLUGIN_NAME'],
-    })
-    exit(0)
 
-# Make the root template
-build_templates(params['CATSOOP']['ROOM_SELECTION_TEMPLATE'], room_destination, {
-        'rooms': repr(params['ROOMS']),
-})
+CSS_TOKEN = re.compile(r'''"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|/\*.*?\*/|\s+|[^"'/\s]+|.''', re.S)
+CSS_PUNCTUATION = '{};,>'
+
+def minify_css(source):
+    # Drop comments and collapse runs of whitespace to one space, leaving strings alone.  Spaces are
+    # only dropped entirely next to { } ; , or >, and after ':', where they can never matter; in
+    # particular not before ':', where a space is a descendant combinator (".table :first-child").
+    out = []
+    space = False
+    for token in CSS_TOKEN.findall(source):
+        if token.isspace() or token.startswith('/*'):
+            space = True
+            continue
+        string = token[0] in '"\''
+        if not string:
+            token = token.replace(';}', '}')
+            if token[0] == '}' and out and out[-1][0] not in '"\'' and out[-1].endswith(';'):
+                out[-1] = out[-1][:-1]
+                if not out[-1]:
+                    out.pop()
+        if space and out and out[-1][-1] not in CSS_PUNCTUATION + ':' and token[0] not in CSS_PUNCTUATION:
+            out.append(' ')
+        space = False
+        out.append(token)
+    return ''.join(out) + '\n'
+
+def build_asset(src, dest_dir, url_root, dry_run=False):
+    # Write a copy of src named with its content hash (plus a gzipped copy, for nginx's
+    # gzip_static) into dest_dir, and return its URL; if src has not been built, return None.
+    # Files which already exist are not rewritten, since their names determine their contents.
+    # Stylesheets are minified; scripts are copied as they are, since only a real JS parser (in the
+    # bundler) could minify them safely, and gzip takes most of the gain anyway.
+    if not os.path.isfile(src):
+        print('Warning: {} not found, using unversioned asset'.format(src))
+        return None
+    base, ext = os.path.splitext(os.path.basename(src))
+    with open(src) as f:
+        content = f.read()
+    if ext == '.css':
+        content = minify_css(content)
+        ext = '.min' + ext
+    content = content.encode('utf-8')
+    filename = '{}.{}{}'.format(base, hashlib.sha256(content).hexdigest()[:12], ext)
+    if not dry_run:
+        mkdir(dest_dir)
+        for name, data in ((filename, content), (filename + '.gz', gzip.compress(content, mtime=0))):
+            if not os.path.isfile(os.path.join(dest_dir, name)):
+                with open(os.path.join(dest_dir, name), 'wb') as f:
+                    f.write(data)
+    return '/'.join([url_root.rstrip('/'), 'assets', filename])
+
+def asset_tags(css, js):
+    return ''.join(
+        ['<link href="{}" rel="stylesheet">'.format(url) for url in css] +
+        ['<script src="{}"></script>'.format(url) for url in js]
+    )
+
+def build_assets(params, dry_run=False):
+    # Build fingerprinted bundles of the queue and broadcast assets, and return the prebuilt tag
+    # strings for the plugin templates
+    assets = params.get('ASSETS', {})
+    dest_dir = assets.get('DESTINATION', 'dist/www/assets')
+    www = assets.get('QUEUE_SOURCE', 'dist/www')
+    broadcast = assets.get('BROADCAST_SOURCE', '../__STATIC__')
+    url_root = params['URL_ROOT']
+
+    queue_css = build_asset(os.path.join(www, 'css', 'queue.css'), dest_dir, url_root, dry_run)
+    queue_js = build_asset(os.path.join(www, 'js', 'queue.js'), dest_dir, url_root, dry_run)
+    broadcast_css = build_asset(os.path.join(broadcast, 'broadcast.css'), dest_dir, url_root, dry_run)
+    broadcast_js = build_asset(os.path.join(broadcast, 'broadcast.js'), dest_dir, url_root, dry_run)
+
+    urljoin = lambda *parts: '/'.join(parts).replace('//', '/')
+    tags = {
+        'queue_css_tags': asset_tags([queue_css or urljoin(url_root, 'css', 'queue.css')], []),
+        'queue_js_tags': asset_tags([], [queue_js or urljoin(url_root, 'js', 'queue.js')]),
+        # None makes the broadcast preload code fall back to the unversioned files in __STATIC__
+        'broadcast_asset_tags': asset_tags([broadcast_css], [broadcast_js]) if broadcast_css and broadcast_js else None,
+    }
+    if not dry_run:
+        mkdir(dest_dir)
+        with open(os.path.join(dest_dir, 'assets.json'), 'w') as f:
+            json.dump(tags, f, indent=4)
+    return tags
+
+
+PLUGIN_MODULE = 'queue_plugin.py'
+
+def render_plugin(src, dest, context, plugin_name):
+    # Render the plugin templates.  The hooks import PLUGIN_MODULE under a name which includes a
+    # hash of its rendered contents, so that a CAT-SOOP worker which imported an older version of
+    # the module (which stays in sys.modules) uses the new one once the hooks are regenerated.
+    with open(os.path.join(src, PLUGIN_MODULE)) as f:
+        module = string.Template(f.read()).substitute(**context)
+    return render_templates(src, dest, dict(
+        context,
+        queue_module=repr('queue_plugin_{}'.format(content_hash(module)[:12])),
+        queue_plugin_name=repr(plugin_name),
+    ))
 
-# Make a room page for each room
-for room in params['ROOMS']:
-    build_templates(params['CATSOOP']['ROOM_TEMPLATE'], os.path.join(room_destination, room), {
+def render_room(params, room, room_destination, templates=None):
+    return render_templates(params['CATSOOP']['ROOM_TEMPLATE'], room_destination, {
             'queue_room_name': room,
             'queue_plugin_name': params['CATSOOP']['PLUGIN_NAME'],
-    })
+    }, templates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the CAT-SOOP plugin and room pages')
+    parser.add_argument('params', help='JSON of the queue params (config/params.js)')
+    parser.add_argument('destination', help='output directory')
+    parser.add_argument('--dry-run', action='store_true', help="print a diff of what would change, but don't write anything")
+    args = parser.parse_args()
+
+    params = json.loads(args.params)
+    destination = args.destination
+
+    room_destination = os.path.join(destination, 'pages')
+    plugin_destination = os.path.join(destination, 'plugin')
+
+
+    if not params['ROOMS']:
+        error('No room names specified')
+
+    # Make fingerprinted asset bundles
+    tags = build_assets(params, args.dry_run)
+
+    # Make plugin
+    outputs = render_plugin(params['CATSOOP']['PLUGIN_TEMPLATE'], plugin_destination, {
+            'queue_room': repr(params['ROOMS'][0] if len(params['ROOMS']) == 1 else None),
+            'queue_url_root': repr(params['URL_ROOT']),
+            'queue_css_tags': repr(tags['queue_css_tags']),
+            'queue_js_tags': repr(tags['queue_js_tags']),
+            'broadcast_asset_tags': repr(tags['broadcast_asset_tags']),
+    }, params['CATSOOP']['PLUGIN_NAME'])
+
+    # In the case of only one room, there's no need for a root page, so this just
+    # makes the one room page
+    if len(params['ROOMS']) == 1:
+        outputs.update(render_room(params, params['ROOMS'][0], room_destination))
+    else:
+        # Make the root template
+        outputs.update(render_templates(params['CATSOOP']['ROOM_SELECTION_TEMPLATE'], room_destination, {
+                'rooms': repr(params['ROOMS']),
+        }))
+
+        # Make a room page for each room
+        templates = load_templates(params['CATSOOP']['ROOM_TEMPLATE'])
+        for room in params['ROOMS']:
+            outputs.update(render_room(params, room, os.path.join(room_destination, room), templates))
+
+    write_outputs(destination, outputs, args.dry_run)
+
+if __name__ == '__main__':
+    main()
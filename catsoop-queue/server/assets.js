@@ -0,0 +1,14 @@
+// Fingerprinted bundles, built by scripts/make_catsoop.py: queue.<hash>.js, queue.<hash>.min.css, etc.
+// Their names change whenever their contents do, so they may be cached for a year.
+const FINGERPRINTED = /\.[0-9a-f]{12}(\.min)?\.(js|css)$/;
+
+function set_cache_headers(res, file) {
+    if (FINGERPRINTED.test(file)) {
+        res.setHeader('Cache-Control', 'public, max-age=31536000, immutable');
+    }
+}
+
+module.exports = {
+    FINGERPRINTED,
+    set_cache_headers,
+};
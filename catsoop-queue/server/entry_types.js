@@ -3,6 +3,7 @@ const util = require('./util');
 const spliceOut = util.spliceOut;
 const db = require('./rethinkdb');
 const catsoop = require('./catsoop');
+const remote_urls = require('./remote_urls');
 
 class Entry {
     constructor(db_doc) {
@@ -29,13 +30,16 @@ class Entry {
 	    if (users.hasOwnProperty(this.username) && users[this.username].hasOwnProperty("subject")){
 		real_name += " (" + users[this.username].subject + ")";
 	    }
+            const extra = {group: [{username, real_name}]};
+            const claimant_url = this.data.claimant && remote_urls.get(this.data.claimant);
+            if (claimant_url) {
+                extra.claimant_url = claimant_url;
+            }
             return Promise.resolve({
                 data: Object.assign(
                     {},
                     this.data,
-                    {
-                        group: [{username, real_name}]
-                    }
+                    extra
                 ),
                 type: this.type,
                 actions: this.actions(user),
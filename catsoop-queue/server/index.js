@@ -5,12 +5,20 @@ const http = require('http');
 const express = require('express');
 
 const params = require('../config/params');
+const assets = require('./assets');
 const make_queue = require('./queue');
+const remote_urls = require('./remote_urls');
 const log = require('./log');
 
 const app = express();
 app.set('trust proxy', 'loopback');
-app.use('/', express.static(path.join(__dirname, '../www')));
+app.use('/', express.static(path.join(__dirname, '../www'), {
+    // fingerprinted bundles (built by scripts/make_catsoop.py) never change, so may be cached for a year
+    setHeaders: assets.set_cache_headers,
+}));
+
+// staff remote queue urls, published by catsoop's remote_queue page (local requests only)
+app.post('/remote_urls', remote_urls.handler);
 
 const server = http.Server(app);
 
@@ -21,3 +29,16 @@ const queue = make_queue(server, {
 server.listen(params.EXPRESS.PORT, () => {
     log.info(`listening on port ${params.EXPRESS.PORT}`, {port: params.EXPRESS.PORT, url_root: '/'}, 'listening');
 });
+
+if (params.REMOTE_URLS.SOCKET) {
+    // also accept url publishes on a unix socket, so catsoop need not use the network
+    try {
+        fs.unlinkSync(params.REMOTE_URLS.SOCKET);
+    }
+    catch (err) {
+        if (err.code !== 'ENOENT') throw err;
+    }
+    http.Server(app).listen(params.REMOTE_URLS.SOCKET, () => {
+        log.info(`listening on ${params.REMOTE_URLS.SOCKET}`, {socket: params.REMOTE_URLS.SOCKET}, 'listening');
+    });
+}
@@ -7,6 +7,7 @@ const db = require('./rethinkdb');
 const log = require('./log');
 const util = require('./util');
 const entry_types = require('./entry_types');
+const remote_urls = require('./remote_urls');
 const params = require('../config/params');
 
 const default_options = {
@@ -200,6 +201,29 @@ module.exports = function make_queue(server, user_options) {
 
 
 
+    /// Re-send entries claimed by staff whose remote url changed, so students see the new url
+    remote_urls.on('change', (claimant) => {
+        for (let room of params.ROOMS) {
+            const entries = Object.keys(ENTRIES[room])
+                .map(username => ENTRIES[room][username])
+                .filter(entry => entry.data.claimant === claimant);
+            if (!entries.length) continue;
+            for (let username of Object.keys(SOCKETS[room])) {
+                let user = USERS[username];
+                let sockets = SOCKETS[room][username];
+                Promise.all(entries.map(entry => entry.render(user, USERS))).then(rendered => {
+                    for (let socket of sockets) {
+                        socket.emit('edit', {
+                            added_entries: [],
+                            edited_entries: rendered,
+                            deleted_usernames: [],
+                        });
+                    }
+                });
+            }
+        }
+    });
+
     /// Start listening for connections
     io.on('connection', (socket) => {
         log.debug('incoming socket connection', {connection: "connect", socket: socket});
@@ -0,0 +1,74 @@
+const EventEmitter = require('events');
+
+const log = require('./log');
+
+// Cache of active staff remote queue (video meeting) urls, published by the catsoop remote_queue
+// page (RemoteQueue.URL_NOTIFY) whenever staff save their settings.  Claimed entries carry their
+// claimant's url (data.claimant_url), so students need not ask catsoop for it.
+
+const URLS = {};
+const events = new EventEmitter();
+
+function get(username) {
+    const entry = URLS[username];
+    return entry ? entry.url : null;
+}
+
+// Record username's url data ({url, active, time}); returns true if the cached url changed.
+// Publishes may arrive out of order (they are retried), so older data is ignored.
+function update(username, data) {
+    const old = URLS[username];
+    if (old && data.time && old.time && data.time < old.time) {
+        return false;
+    }
+    const url = (data.active && data.url) ? String(data.url) : null;
+    URLS[username] = {url, time: data.time || null};
+    if (url === (old ? old.url : null)) {
+        return false;
+    }
+    events.emit('change', username, url);
+    return true;
+}
+
+function is_local(req) {
+    // requests proxied from elsewhere (by nginx) have a non-loopback req.ip; unix sockets have none
+    const ip = req.ip;
+    return !ip || ip === '127.0.0.1' || ip === '::1' || ip === '::ffff:127.0.0.1';
+}
+
+// Express handler for POST <url_root>remote_urls, with a JSON body {username, url, active, time}
+function handler(req, res) {
+    if (!is_local(req)) {
+        res.status(403).end();
+        return;
+    }
+    let body = '';
+    req.setEncoding('utf8');
+    req.on('data', chunk => {
+        body += chunk;
+    });
+    req.on('end', () => {
+        let data;
+        try {
+            data = JSON.parse(body);
+        }
+        catch (err) {
+            res.status(400).end();
+            return;
+        }
+        if (!data || typeof data.username !== 'string') {
+            res.status(400).end();
+            return;
+        }
+        const changed = update(data.username, data);
+        log.info('remote url update', {type: 'remote_url', username: data.username, changed});
+        res.json({changed});
+    });
+}
+
+module.exports = {
+    get,
+    update,
+    handler,
+    on: (name, listener) => events.on(name, listener),
+};
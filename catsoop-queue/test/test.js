@@ -907,3 +907,73 @@ describe('server', function() {
         });
     });
 });
+
+describe('remote urls', function() {
+    const remote_urls = require('../server/remote_urls');
+
+    it('should keep the urls of active staff only', function() {
+        assert.isTrue(remote_urls.update('ru_staff1', {url: 'https://example.com/a', active: true, time: 1}));
+        assert.equal(remote_urls.get('ru_staff1'), 'https://example.com/a');
+        assert.isTrue(remote_urls.update('ru_staff1', {url: 'https://example.com/a', active: false, time: 2}));
+        assert.isNull(remote_urls.get('ru_staff1'));
+    });
+
+    it('should ignore out of order updates', function() {
+        remote_urls.update('ru_staff2', {url: 'https://example.com/new', active: true, time: 20});
+        assert.isFalse(remote_urls.update('ru_staff2', {url: 'https://example.com/old', active: true, time: 10}));
+        assert.equal(remote_urls.get('ru_staff2'), 'https://example.com/new');
+    });
+
+    it('should announce url changes', function(done) {
+        remote_urls.on('change', function listener(username, url) {
+            if (username !== 'ru_staff3') return;
+            assert.equal(url, 'https://example.com/c');
+            done();
+        });
+        remote_urls.update('ru_staff3', {url: 'https://example.com/c', active: true, time: 1});
+    });
+});
+
+describe('fingerprinted assets', function() {
+    const os = require('os');
+    const path = require('path');
+    const express = require('express');
+    const assets = require('../server/assets');
+
+    let dir;
+    let server;
+    before(function(done) {
+        dir = fs.mkdtempSync(path.join(os.tmpdir(), 'queue-assets-'));
+        for (const name of ['queue.0123456789ab.js', 'queue.0123456789ab.min.css', 'queue.js']) {
+            fs.writeFileSync(path.join(dir, name), '');
+        }
+        const app = express();
+        app.use('/', express.static(dir, {setHeaders: assets.set_cache_headers}));
+        server = http.Server(app).listen(0, done);
+    });
+
+    after(function() {
+        server.close();
+    });
+
+    function cache_control(name) {
+        return new Promise((resolve, reject) => {
+            http.get(`http://localhost:${server.address().port}/${name}`, res => {
+                res.resume();
+                resolve(res.headers['cache-control']);
+            }).on('error', reject);
+        });
+    }
+
+    it('should cache hashed scripts for a year', function() {
+        return assert.eventually.include(cache_control('queue.0123456789ab.js'), 'max-age=31536000');
+    });
+
+    it('should cache hashed stylesheets for a year', function() {
+        return assert.eventually.include(cache_control('queue.0123456789ab.min.css'), 'max-age=31536000');
+    });
+
+    it('should not cache unversioned files for long', function() {
+        return assert.eventually.notInclude(cache_control('queue.js'), 'max-age=31536000');
+    });
+});
@@ -0,0 +1,112 @@
+'''
+Tests of the queue plugin's button insertion (catsoop/plugin-template/queue_plugin.py); load_plugin
+is also used by scripts/bench_queue_buttons.py
+
+    python3 -m unittest discover -s test -p 'test_*.py'	# in catsoop-queue
+'''
+
+import os
+import string
+import types
+import unittest
+
+try:
+    import bs4
+except ImportError:
+    bs4 = None
+
+PLUGIN_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'catsoop', 'plugin-template', 'queue_plugin.py')
+
+def load_plugin():
+    with open(PLUGIN_MODULE) as f:
+        source = string.Template(f.read()).substitute(
+            queue_url_root=repr(''),
+            queue_css_tags=repr(''),
+            queue_js_tags=repr(''),
+        )
+    plugin = types.ModuleType('queue_plugin')
+    exec(compile(source, PLUGIN_MODULE, 'exec'), plugin.__dict__)
+    return plugin
+
+plugin = load_plugin()
+
+QUESTIONS = {'q1': ({'qtype': 'pythoncode'}, {'csq_name': 'q1', 'csq_display_name': 'Question 1'})}
+
+def question(name='q1', buttons_attrs='id="q1_buttons"'):
+    return (
+        '<div class="question" id="cs_qdiv_{name}">'
+        '<div id="{name}_rendered_question"><input id="{name}"></div>'
+        '<span {attrs}><button>Submit</button></span>'
+        '</div>'
+    ).format(name=name, attrs=buttons_attrs)
+
+def insert(mode, content, questions=QUESTIONS):
+    context = {
+        'queue_enable': True,
+        'queue_questions': questions,
+        'queue_button_injection': mode,
+        'cs_content': content,
+    }
+    plugin.post_handle(context)
+    return context['cs_content']
+
+class TestInsertButtons(unittest.TestCase):
+
+    def check(self, content, expected_after):
+        '''
+        Check that the buttons are inserted (only) right after expected_after, or not at all if it is None
+        '''
+        result = insert('string', content)
+        buttons = plugin.buttons_html(*QUESTIONS['q1'])
+        if expected_after is None:
+            self.assertEqual(result, content)
+            return
+        self.assertEqual(result.count('q1_queue_buttons'), 1)
+        self.assertIn(expected_after + buttons, result)
+        if bs4 is not None:
+            self.assertEqual(self.buttons(result), self.buttons(insert('soup', content)))
+
+    def buttons(self, content):
+        soup = bs4.BeautifulSoup(content, 'html.parser')
+        return [(str(span.find_previous_sibling()), str(span)) for span in soup.find_all(id='q1_queue_buttons')]
+
+    def test_inserts_after_buttons(self):
+        self.check(question(), '<button>Submit</button></span>')
+
+    def test_id_after_other_attributes(self):
+        self.check(question(buttons_attrs='class="b" id="q1_buttons"'), '<button>Submit</button></span>')
+
+    def test_ignores_data_id(self):
+        # a decoy element with data-id="q1_buttons" comes first; the buttons go after the real one
+        content = question().replace('<div id="q1_rendered_question">',
+                                     '<div data-id="q1_buttons"></div><div id="q1_rendered_question">')
+        self.check(content, '<button>Submit</button></span>')
+
+    def test_only_data_id(self):
+        self.check(question(buttons_attrs='data-id="q1_buttons"'), None)
+
+    def test_buttons_outside_question(self):
+        # q1_buttons after the end of cs_qdiv_q1: 'soup' mode adds no buttons, and neither should 'string'
+        content = '<div id="cs_qdiv_q1"><p>text</p></div><span id="q1_buttons"><button>Submit</button></span>'
+        self.check(content, None)
+
+    def test_buttons_before_question(self):
+        content = '<span id="q1_buttons"></span><div id="cs_qdiv_q1"><p>text</p></div>'
+        self.check(content, None)
+
+    def test_nested_divs(self):
+        content = question().replace('<input id="q1">', '<div><div><input id="q1"></div></div>')
+        self.check(content, '<button>Submit</button></span>')
+
+    def test_unclosed_question(self):
+        self.check('<div id="cs_qdiv_q1"><span id="q1_buttons"></span>', None)
+
+    def test_several_questions(self):
+        questions = dict(QUESTIONS, q2=({'qtype': 'checkoff'}, {'csq_name': 'q2', 'csq_display_name': 'Question 2'}))
+        result = insert('string', question('q1') + question('q2', 'id="q2_buttons"'), questions)
+        self.assertEqual(result.count('_queue_buttons'), 2)
+        self.assertEqual(result.count('Ask for Checkoff'), 1)
+        self.assertLess(result.index('q1_queue_buttons'), result.index('cs_qdiv_q2'))
+
+if __name__ == '__main__':
+    unittest.main()
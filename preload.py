@@ -1,3 +1,16 @@
+import os
+import sys
+import hmac
+import time
+import zlib
+import fcntl
+import array
+import bisect
+import struct
+import threading
+import hashlib
+import contextlib
+import importlib.util
 
 def cs_post_load(context):
 
@@ -16,10 +29,288 @@ def cs_add_broadcast_messaging_js(context):
     '''
     user_role = context.get('cs_user_info', {}).get('role', None)
     is_staff = user_role in {'LA', 'TA', 'UTA', 'Admin', 'Instructor'}
+    msg_url = "broadcast_staff" if is_staff else "broadcast"	# message file for this audience, served by nginx
     py2js = {True: 'true', False: 'false'}
     is_staff = py2js[is_staff]
-    context['cs_scripts'] += '<script type="text/javascript"">CS_USER_IS_STAFF=%s</script>' % is_staff
-    context['cs_scripts'] += '<script type="text/javascript"">CS_COURSE_URL="%s/msg"</script>' % context.get("cs_url_root") # special nginx url to lower load on catsoop
-    context['cs_scripts'] += '<script type="text/javascript" src="COURSE/broadcast.js"></script>'
-    context['cs_scripts'] += """<link rel="stylesheet" href="COURSE/broadcast.css">"""
+    url_root = context.get("cs_url_root")
+    # the push service (scripts/broadcast_push.py) takes the stream's audience from this signed token
+    token = broadcast_events_token("staff" if msg_url == "broadcast_staff" else "all")
+    context['cs_scripts'] += ('<script type="text/javascript">'
+                              'CS_USER_IS_STAFF=%s;'
+                              'CS_COURSE_URL="%s/msg";'		# special nginx url to lower load on catsoop
+                              'CS_BROADCAST_URL="%s/msg/%s";'
+                              'CS_BROADCAST_EVENTS_URL="%s/msg/broadcast_events?token=%s";'
+                              '</script>') % (is_staff, url_root, url_root, msg_url, url_root, token)
+    # fingerprinted, long-cacheable bundles built by catsoop-queue/scripts/make_catsoop.py (set by the queue plugin)
+    asset_tags = context.get('broadcast_asset_tags')
+    if asset_tags:
+        context['cs_scripts'] += asset_tags
+    else:
+        context['cs_scripts'] += '<script type="text/javascript" src="COURSE/broadcast.js"></script>'
+        context['cs_scripts'] += """<link rel="stylesheet" href="COURSE/broadcast.css">"""
 
+BROADCAST_PUSH_KEY_FILE = "~/cs_broadcast_push.key"	# secret shared with scripts/broadcast_push.py, which imports broadcast_push_key
+BROADCAST_EVENTS_TOKEN_TTL = 12 * 3600
+
+def broadcast_push_key(key_file=BROADCAST_PUSH_KEY_FILE):
+    '''
+    Return the secret key shared with the broadcast push service, creating it if missing
+    '''
+    fn = os.path.expanduser(key_file)
+    try:
+        with open(fn, 'rb') as ifp:
+            return ifp.read()
+    except FileNotFoundError:
+        pass
+    # write the key to a private temporary file, and link it into place unless another process got there first
+    tmpfn = "%s.%d.tmp" % (fn, os.getpid())
+    fd = os.open(tmpfn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as ofp:
+        ofp.write(os.urandom(32).hex().encode("ascii"))
+    try:
+        os.link(tmpfn, fn)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmpfn)
+    with open(fn, 'rb') as ifp:
+        return ifp.read()
+
+def broadcast_events_token(audience, ttl=BROADCAST_EVENTS_TOKEN_TTL):
+    '''
+    Return a token for the broadcast push service's event stream for audience ("all" or "staff"),
+    valid for ttl seconds: "<audience>.<expiry time>.<HMAC-SHA256 of the two>"
+    '''
+    payload = "%s.%d" % (audience, int(time.time() + ttl))
+    return "%s.%s" % (payload, hmac.new(broadcast_push_key(), payload.encode("ascii"), hashlib.sha256).hexdigest())
+
+#-----------------------------------------------------------------------------
+# page code imported once per worker process, for remote_queue and broadcast
+
+def cs_import_page_module(context, name):
+    '''
+    Import name.py from the directory of the page being served (e.g. remote_queue_page.py, for
+    remote_queue/content.py), once per catsoop worker process, and return the module.
+
+    catsoop runs a page's content.py on every request, so the remote_queue and broadcast pages
+    keep their classes in such a module, and content.py just calls into it.  The module's name in
+    sys.modules includes its file's mtime and size, so an edited file is imported again without
+    restarting catsoop; the version it replaces is dropped from sys.modules.
+    '''
+    filename = os.path.join(context['cs_data_root'], 'courses', *context['cs_path_info'], name + '.py')
+    st = os.stat(filename)
+    prefix = "cs_page_%s_%08x_" % (name, zlib.crc32(filename.encode("utf-8")))
+    module_name = prefix + "%x_%x" % (st.st_mtime_ns, st.st_size)
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(module_name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for other in [x for x in list(sys.modules) if x.startswith(prefix) and x != module_name]:
+        sys.modules.pop(other, None)
+    return sys.modules.setdefault(module_name, module)
+
+#-----------------------------------------------------------------------------
+# request counts and latency histograms, for remote_queue and broadcast
+
+class RequestMetrics:
+    '''
+    Counts and latency histograms of a page's dispatch actions, and of the csm_cslog calls they make,
+    shared by all catsoop worker processes.
+
+    Observations are kept in memory during a request, and added to a small counter file
+    (METRICS_DIR/<page>.metrics) by flush(), with one locked read and write per request.  The
+    file holds, for each (kind, name) metric, the count, the total time in microseconds, and the
+    count in each latency bucket.  If the number of metrics or buckets changes, the counts start
+    over; delete the file after reordering them.  prometheus_text() returns the totals in the
+    Prometheus text exposition format (served to staff by ?stats).
+
+    observe() may be called from several threads (e.g. broadcast's SAVE_WORKERS timing their
+    csm_cslog calls), so the pending observations are guarded by a lock, and flush() takes them
+    all at once.
+    '''
+
+    METRICS_DIR = "~/cs_metrics"
+    BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]	# seconds
+    CSLOG_CALLS = ['most_recent', 'read_log', 'update_log', 'overwrite_log', 'modify_most_recent']
+
+    def __init__(self, page, actions):
+        self.page = page
+        self.metrics = [('action', x) for x in actions] + [('cslog', x) for x in self.CSLOG_CALLS]
+        self.index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.width = 2 + len(self.BUCKETS) + 1		# count, total microseconds, buckets (the last is +Inf)
+        self.filename = os.path.join(os.path.expanduser(self.METRICS_DIR), "%s.metrics" % page)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def observe(self, kind, name, seconds):
+        '''
+        Record one call of the (kind, name) metric taking seconds
+        '''
+        i = self.index.get((kind, name))
+        if i is None:
+            return
+        bucket = 2 + bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            counts = self.pending.get(i)
+            if counts is None:
+                counts = self.pending[i] = [0] * self.width
+            counts[0] += 1
+            counts[1] += int(seconds * 1e6)
+            counts[bucket] += 1
+
+    def timed(self, kind, name, func, *args, **kwargs):
+        '''
+        Call func(*args, **kwargs), recording its latency under the (kind, name) metric
+        '''
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.observe(kind, name, time.perf_counter() - start)
+
+    def timed_cslog(self, cslog):
+        '''
+        Return a stand-in for the cslog module which records the latency of its calls
+        '''
+        metrics = self
+
+        class TimedCSLog:
+            def __getattr__(self, attr):
+                func = getattr(cslog, attr)
+                if attr in metrics.CSLOG_CALLS:
+                    func = lambda *args, _func=func, **kwargs: metrics.timed('cslog', attr, _func, *args, **kwargs)
+                setattr(self, attr, func)	# so later lookups of attr skip __getattr__
+                return func
+
+        return TimedCSLog()
+
+    @contextlib.contextmanager
+    def timing_cslog(self, context):
+        '''
+        Within the with block, make context's csm_cslog record the latency of its calls (see
+        timed_cslog); the real module is put back afterwards, so that calls made later in the
+        request (by other hooks, or by catsoop itself) are neither counted nor slowed down.
+        '''
+        cslog = context['csm_cslog']
+        context['csm_cslog'] = self.timed_cslog(cslog)
+        try:
+            yield
+        finally:
+            context['csm_cslog'] = cslog
+
+    def flush(self):
+        '''
+        Add pending observations to the counter file, holding an exclusive lock on it
+        '''
+        if not self.pending:
+            return
+        size = 8 * self.width * len(self.metrics)
+        try:
+            try:
+                fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+        except OSError:
+            return
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, size + 1, 0)
+            totals = array.array('Q', raw if len(raw) == size else bytes(size))
+            for i, counts in pending.items():
+                for j, value in enumerate(counts):
+                    totals[i * self.width + j] += value
+            os.pwrite(fd, totals.tobytes(), 0)
+            if len(raw) > size:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    def totals(self):
+        '''
+        Return dict of (kind, name) -> list of [count, total microseconds, bucket counts...]
+        '''
+        size = 8 * self.width * len(self.metrics)
+        try:
+            with open(self.filename, 'rb') as ifp:
+                raw = ifp.read(size + 1)
+        except OSError:
+            raw = b""
+        totals = array.array('Q', raw if len(raw) == size else bytes(size))
+        return {metric: totals[i * self.width:(i + 1) * self.width].tolist() for i, metric in enumerate(self.metrics)}
+
+    def prometheus_text(self):
+        '''
+        Return totals in the Prometheus text exposition format
+        '''
+        lines = []
+        totals = self.totals()
+        for kind, label in [('action', 'action'), ('cslog', 'call')]:
+            metric = "catsoop_%s_%s_seconds" % (self.page, kind)
+            lines.append("# TYPE %s histogram" % metric)
+            for (mkind, name), counts in totals.items():
+                if mkind != kind:
+                    continue
+                cumulative = 0
+                for le, n in zip(self.BUCKETS + ["+Inf"], counts[2:]):
+                    cumulative += n
+                    lines.append('%s_bucket{%s="%s",le="%s"} %d' % (metric, label, name, le, cumulative))
+                lines.append('%s_sum{%s="%s"} %.6f' % (metric, label, name, counts[1] / 1e6))
+                lines.append('%s_count{%s="%s"} %d' % (metric, label, name, counts[0]))
+        return "\n".join(lines) + "\n"
+
+#-----------------------------------------------------------------------------
+# per-user rate limits, for polling endpoints
+
+class RateLimiter:
+    '''
+    Per-user token buckets, shared by all catsoop worker processes: each user may make up to
+    burst requests at once, and then rate requests per second.
+
+    The buckets are kept in SLOTS fixed slots of one small file (RATE_DIR/<name>.buckets),
+    each holding a user's token count and the time it was last updated.  Users are assigned
+    slots by a hash of their name, so two users may occasionally share a bucket; this only
+    makes the limit stricter for them.  Each check is one read and write of a slot, holding a
+    lock on that slot only (an fcntl record lock, so checks for other users don't wait).
+    '''
+
+    RATE_DIR = "~/cs_metrics"	# with the RequestMetrics counter files
+    SLOTS = 8192
+    SLOT = struct.Struct("<dd")		# tokens, time of last update
+
+    def __init__(self, name, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.filename = os.path.join(os.path.expanduser(self.RATE_DIR), "%s.buckets" % name)
+
+    def allow(self, key):
+        '''
+        Take a token from key's bucket; return (True, 0) if there was one, else (False, seconds until there will be)
+        Requests are allowed if the bucket file cannot be used.
+        '''
+        offset = self.SLOT.size * (zlib.crc32(key.encode("utf-8")) % self.SLOTS)
+        try:
+            try:
+                fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+        except OSError:
+            return True, 0
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX, self.SLOT.size, offset)
+            raw = os.pread(fd, self.SLOT.size, offset)
+            tokens, last = self.SLOT.unpack(raw) if len(raw) == self.SLOT.size else (0, 0)
+            now = time.time()
+            tokens = min(self.burst, tokens + max(now - last, 0) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            os.pwrite(fd, self.SLOT.pack(tokens, now), offset)
+        finally:
+            os.close(fd)
+        return allowed, 0 if allowed else (1 - tokens) / self.rate
@@ -0,0 +1,749 @@
+'''
+remote queue
+
+The page's code, imported once per catsoop worker process
+
+catsoop runs a page's content.py on every request, so the page's classes are kept here instead.
+content.py imports this module with cs_import_page_module (from the top-level preload.py), which
+imports it again only when the file changes, and runs RemoteQueue(globals()).dispatch(cs_form).
+The classes get the request's globals (cs_username, csm_cslog, ...) from that context dict, and
+set catsoop's response variables (cs_handler, response, ...) in it.
+'''
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import socket
+import struct
+import atexit
+import logging
+import logging.handlers
+import contextlib
+import queue
+import tempfile
+import threading
+import http.client
+import urllib.parse
+import datetime
+import traceback
+
+LOGGER = logging.getLogger("cs")
+
+#-----------------------------------------------------------------------------
+# cross-process cache of staff url data
+
+class UrlCache:
+    '''
+    Cache of staff url data, shared by all catsoop worker processes.
+
+    Each entry is a small JSON file (one per staff username) in cache_dir, holding
+    the time it was stored and the url data.  Entries older than ttl seconds are
+    treated as missing.  Hit and miss counts are kept in a small counter file in
+    the same directory, so that they add up across processes.
+
+    Concurrent misses for the same username are coalesced by get_or_load: the first
+    request to take the entry's lock file reads the url data, and the others wait for
+    it, then find the fresh entry ("coalesced") instead of each reading the log.
+    '''
+
+    COUNTERS = ['hits', 'misses', 'coalesced']
+
+    def __init__(self, cache_dir, ttl=30):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_filename(self, username):
+        return os.path.join(self.cache_dir, "%s.json" % urllib.parse.quote(username, safe=''))
+
+    def get(self, username, count=True):
+        '''
+        Return cached url data for username, or None if missing or expired
+        '''
+        try:
+            with open(self.entry_filename(username)) as ifp:
+                entry = json.load(ifp)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or time.time() - entry.get("time", 0) > self.ttl:
+            if count:
+                self.count("misses")
+            return None
+        if count:
+            self.count("hits")
+        return entry.get("data")
+
+    def get_or_load(self, username, load, known=None):
+        '''
+        Return cached url data for username; if missing or expired, return load(username), and cache it.
+        Only one process at a time loads a given username: others wait, then use what it cached.
+        If known(username) is false, load(username) is returned without caching it, counting a
+        miss, or making a lock file, so that lookups of arbitrary usernames leave nothing behind.
+        '''
+        data = self.get(username, count=False)
+        if data is not None:
+            self.count("hits")
+            return data
+        if known is not None and not known(username):
+            return load(username)
+        self.count("misses")
+        with self.lock(username):
+            data = self.get(username, count=False)
+            if data is not None:
+                self.count("coalesced")
+                return data
+            data = load(username)
+            self.put(username, data)
+            return data
+
+    @contextlib.contextmanager
+    def lock(self, username):
+        '''
+        Hold username's entry lock file.  Loads (in get_or_load) and saves of the url data both
+        hold it while they write the entry, so that a load which read the log before a save cannot
+        overwrite the saved entry with the old data.
+        '''
+        try:
+            lockfp = open(self.entry_filename(username) + ".lock", 'w')
+        except OSError:
+            yield
+            return
+        with lockfp:
+            fcntl.flock(lockfp, fcntl.LOCK_EX)
+            yield
+
+    def put(self, username, data):
+        '''
+        Store url data for username; the file is replaced atomically, so readers never see partial entries
+        '''
+        entry = {'time': time.time(), 'data': data}
+        fd, tmpfn = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as ofp:
+                ofp.write(json.dumps(entry))
+            os.replace(tmpfn, self.entry_filename(username))
+        except OSError as err:
+            LOGGER.error("[RemoteQueue] failed to cache url data for username=%s, err=%s" % (username, err))
+            if os.path.exists(tmpfn):
+                os.unlink(tmpfn)
+            self.invalidate(username)
+
+    def invalidate(self, username):
+        try:
+            os.unlink(self.entry_filename(username))
+        except FileNotFoundError:
+            pass
+
+    def count(self, name):
+        '''
+        Increment the named counter, holding an exclusive lock on the counter file
+        '''
+        offset = 8 * self.COUNTERS.index(name)
+        try:
+            fd = os.open(os.path.join(self.cache_dir, "_counters"), os.O_RDWR | os.O_CREAT)
+        except OSError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 8, offset)
+            value = struct.unpack("<Q", raw)[0] if len(raw) == 8 else 0
+            os.pwrite(fd, struct.pack("<Q", value + 1), offset)
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        '''
+        Return dict of counter values
+        '''
+        try:
+            with open(os.path.join(self.cache_dir, "_counters"), 'rb') as ifp:
+                raw = ifp.read()
+        except OSError:
+            raw = b""
+        raw = raw.ljust(8 * len(self.COUNTERS), b"\0")
+        values = struct.unpack("<%dQ" % len(self.COUNTERS), raw[:8 * len(self.COUNTERS)])
+        return dict(zip(self.COUNTERS, values))
+
+#-----------------------------------------------------------------------------
+# aggregated analytics of student url polls and clicks
+
+class UrlAnalytics(logging.Handler):
+    '''
+    Logging handler which counts remote queue events (url polls and clicks) per
+    (event, staff, student, session), and appends the counts to the analytics log
+    as one compact JSON line every flush_interval seconds, or once max_keys
+    different keys have been counted.  Remaining counts are written when the
+    handler is closed (at exit).
+
+    It is run by the AnalyticsListener thread set up by analytics_logger(), so that
+    requests only put a record on an in-memory queue, and never wait for file I/O.
+    The listener calls flush_due() when no record arrives in time, so counts are
+    written within flush_interval seconds even when traffic stops.
+    '''
+
+    def __init__(self, filename, flush_interval=60, max_keys=5000):
+        super().__init__()
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.counts = {}
+        self.since = time.time()
+
+    def emit(self, record):
+        key = getattr(record, "analytics", None)
+        if key is None:
+            return
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self.counts) >= self.max_keys or time.time() - self.since >= self.flush_interval:
+            self.write_counts()
+
+    def seconds_until_flush(self):
+        return max(self.since + self.flush_interval - time.time(), 0)
+
+    def flush_due(self):
+        '''
+        Write the counts if flush_interval seconds have passed since the last write
+        '''
+        with self.lock:
+            if time.time() - self.since >= self.flush_interval:
+                self.write_counts()
+
+    def write_counts(self):
+        now = time.time()
+        if not self.counts:
+            self.since = now
+            return
+        line = json.dumps({'from': round(self.since, 3), 'to': round(now, 3),
+                           'counts': [list(key) + [n] for key, n in self.counts.items()]}, separators=(',', ':'))
+        try:
+            with open(self.filename, 'a') as ofp:
+                ofp.write(line + "\n")
+        except OSError as err:
+            LOGGER.error("[RemoteQueue] failed to write analytics to %s, err=%s" % (self.filename, err))
+        self.counts = {}
+        self.since = now
+
+    def close(self):
+        self.write_counts()
+        super().close()
+
+class AnalyticsListener(logging.handlers.QueueListener):
+    '''
+    QueueListener for a UrlAnalytics handler, which waits for each record only until
+    the handler's counts are due to be written, and writes them if none arrives
+    '''
+
+    def dequeue(self, block):
+        analytics = self.handlers[0]
+        while True:
+            try:
+                return self.queue.get(block, analytics.seconds_until_flush())
+            except queue.Empty:
+                analytics.flush_due()
+
+def analytics_logger(filename):
+    '''
+    Return the logger for remote queue analytics records, which go through a queue to a UrlAnalytics handler.
+    A RemoteQueue is made for each request (and this module is imported again when it changes), but
+    the logger (with its handler and listener thread) lasts for the life of the worker process, so
+    this is only set up once per process.
+    '''
+    logger = logging.getLogger("cs.remote_queue.analytics")
+    marker = object()
+    if logger.__dict__.setdefault("analytics_setup", marker) is marker:	# atomic, in case of concurrent requests
+        records = queue.SimpleQueue()
+        listener = AnalyticsListener(records, UrlAnalytics(filename))
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(logging.handlers.QueueHandler(records))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+#-----------------------------------------------------------------------------
+# publishing staff url data to the queue server
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''
+    HTTPConnection to a server listening on a unix socket
+    '''
+
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+def post_json(endpoint, data, timeout):
+    '''
+    POST JSON of data to endpoint, either "http://host:port/path" or "unix:/path/to/socket" (posted to /remote_urls)
+    Raises an exception on failure, or if the response status is not 2xx.
+    '''
+    if endpoint.startswith("unix:"):
+        conn = UnixHTTPConnection(endpoint[5:], timeout)
+        path = "/remote_urls"
+    else:
+        url = urllib.parse.urlsplit(endpoint)
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+        path = url.path or "/"
+    try:
+        conn.request("POST", path, json.dumps(data), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        if not 200 <= response.status < 300:
+            raise OSError("HTTP status %d" % response.status)
+    finally:
+        conn.close()
+
+def publish_url_data(endpoint, data, retries=3, timeout=2, backoff=0.5):
+    '''
+    Post staff url data to endpoint (the queue server) in a daemon thread, so that the request
+    saving it does not wait.  Failed posts are retried, with exponentially growing delays.
+    Returns the thread.
+    '''
+    def publish():
+        for attempt in range(retries + 1):
+            try:
+                post_json(endpoint, data, timeout)
+                return
+            except Exception as err:
+                error = err
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+        LOGGER.error("[RemoteQueue] failed to publish url data for username=%s to %s, err=%s" % (data.get('username'), endpoint, error))
+
+    thread = threading.Thread(target=publish, name="remote-queue-publish", daemon=True)
+    thread.start()
+    return thread
+
+#-----------------------------------------------------------------------------
+# main dispatch function
+'''
+How this works:
+
+content.py runs:
+    RQ = remote_queue_page.RemoteQueue(globals())
+    cs_problem_spec = RQ.dispatch(cs_form)
+
+This tells catsoop to use the dispatch function of the RemoteQueue for all processing
+
+RemoteQueue.dispatch
+    Given the form data for the page and the person viewing the page, it determines what the person should see.
+    If staff and form_data is empty: show the form for inputting video URL
+    If staff and person has saved info/pressed submit: show 'saved' and save data and update remotequeue database:
+            data = {'url': url, 'active': active}
+            self.cslog.update_log(self.db_name, [], self.username, data)
+    If person is not staff: run ajax_get_url
+    If "get" lists several staff usernames (e.g. get=alice,bob,carol): run ajax_get_urls, which returns JSON
+
+Lookups of staff url data go through a UrlCache (see above) shared by all catsoop
+processes, so that student polls do not each read the remotequeue log.  Saving
+url data replaces the cached entry right away.  Staff can see the cache hit/miss
+counts with "?cache_stats".
+
+Saving url data also updates INDEX_FILE, a JSON dict of {"staff": {username: {"url": url,
+"active": active, "time": time}}} for all staff who have saved url data, which staff can get
+in one request with "?index".  From this, SNAPSHOT_FILE, a JSON dict of {"staff": {username: url}}
+for all active staff, is rewritten.  This is meant to be served directly by nginx, so that student
+browsers can look up claimant urls without a catsoop request; ?get=<staffuser> remains as a fallback.
+
+Each saved record also has the time it was saved, and a count of records saved since the log
+was last compacted ("pending").  Once this reaches COMPACT_EVERY, the staff member's log is
+compacted (see compact_log) into a single record holding the latest state plus a "history"
+list of earlier states, limited to the last HISTORY_DAYS days and HISTORY_MAX entries.  Older
+logs can be compacted with scripts/compact_remote_queue.py.
+
+dispatch records the count and latency of each action (the method handling the request),
+and of the csm_cslog calls made, using RequestMetrics (defined in the top-level preload.py).
+Staff can see these, in the Prometheus text format, with "?stats".
+
+If URL_NOTIFY is set, saved url data is also posted (see publish_url_data) to the queue server,
+which keeps the urls of active staff, and adds the claimant's url to claimed queue entries.
+Students then see the url without looking it up.  The post is made in a background thread, with
+retries, so saving never waits for the queue server.
+
+Each student's ?get requests, single or batch, are rate limited (see RateLimiter in the top-level
+preload.py) to GET_RATE per second, after a burst of up to GET_BURST.  Requests beyond that are
+answered from the url cache only: if a requested staff member's entry is not cached, the response
+is an empty 429 Too Many Requests, with a Retry-After header.
+
+Student url polls (?get) and clicks (?go) are not logged one by one (unless RemoteQueue is
+created with verbose=True); instead they are counted per (event, staff, student, session) by
+a UrlAnalytics handler, which writes the counts to ANALYTICS_LOG in batches.
+'''
+class RemoteQueue:
+
+    db_name = "remote_queue"
+    CACHE_DIR = "~/cs_remote_queue_cache"
+    CACHE_TTL = 30	# seconds
+    SNAPSHOT_FILE = "~/cs_remote_queue.json"
+    INDEX_FILE = "~/cs_remote_queue_index.json"
+    COMPACT_EVERY = 20	# saved records between log compactions
+    HISTORY_DAYS = 14	# keep history of states saved within this many days
+    HISTORY_MAX = 200	# ... but no more than this many
+    ANALYTICS_LOG = "~/cs_remote_queue_analytics.log"
+    URL_NOTIFY = None	# queue server endpoint for saved url data, e.g. "http://127.0.0.1:3100/remote_urls" or "unix:/path/to/socket"
+    URL_NOTIFY_RETRIES = 3
+    GET_RATE = 1	# ?get requests per second allowed for each student ...
+    GET_BURST = 10	# ... after a burst of this many
+    MAX_BATCH = 100	# staff usernames per batch ?get
+    ACTIONS = ['show_form', 'process_form_save', 'ajax_cache_stats', 'ajax_stats', 'ajax_index',
+               'ajax_get_url', 'ajax_get_urls', 'ajax_go_url']
+
+    def __init__(self, context, verbose=False):
+        self.context = context		# the request's globals, in which catsoop runs content.py
+        self.username = context['cs_username']
+        self.verbose = verbose
+        self.analytics = analytics_logger(os.path.expanduser(self.ANALYTICS_LOG))
+        self.cache = UrlCache(os.path.expanduser(self.CACHE_DIR), self.CACHE_TTL)
+        # RequestMetrics and RateLimiter are defined in the top-level preload.py
+        self.metrics = context['RequestMetrics'](self.db_name, self.ACTIONS)
+        self.get_limiter = context['RateLimiter'](self.db_name, self.GET_RATE, self.GET_BURST)
+        #below line is getting info from the .py files in __USERS__ folder
+        user_role = context['cs_user_info'].get('role', None)
+        self.is_authorized = user_role in {'LA', 'TA', 'UTA', 'Admin', 'Instructor'}
+
+        #might want a more robust way to check this in future!
+        # self.is_remote = 'NON-INSTITUTE' in cs_user_info.get('stellar_affiliation','')
+        self.is_remote = True
+        self.my_url = "/".join([context['cs_url_root']] + context['cs_path_info'])
+
+        # current_user = cs_user_info['username']
+
+    @property
+    def cslog(self):
+        '''
+        csm_cslog, as it is in the context now (dispatch swaps in a timed stand-in, see RequestMetrics.timing_cslog)
+        '''
+        return self.context['csm_cslog']
+
+    def dispatch(self, form_data=None):
+        '''
+        main entry point to generate html responses
+        The latency of each action, and of the csm_cslog calls it makes, is recorded in self.metrics.
+        '''
+        action, args = self.route(form_data)
+        if action is None:
+            return ""
+        try:
+            with self.metrics.timing_cslog(self.context):
+                return self.metrics.timed('action', action, getattr(self, action), *args)
+        finally:
+            self.metrics.flush()
+            if self.context.get('cs_handler') and 'queue_profile_finish' in self.context:
+                self.context['queue_profile_finish']()	# ajax responses skip the queue plugin's post_handle, which would save the profile
+
+    def route(self, form_data):
+        '''
+        Return (name of the method which should handle form_data, its arguments); the name is None if there is nothing to do
+        '''
+        if form_data is None:
+            return None, ()
+        if not len(form_data) and self.is_authorized:
+            return 'show_form', ()
+        if 'save' in form_data and self.is_authorized:
+            return 'process_form_save', (form_data,)
+        if 'cache_stats' in form_data and self.is_authorized:
+            return 'ajax_cache_stats', ()
+        if 'stats' in form_data and self.is_authorized:
+            return 'ajax_stats', ()
+        if 'index' in form_data and self.is_authorized:
+            return 'ajax_index', ()
+        if 'get' in form_data:
+            if ',' in (form_data.get('get') or ''):
+                return 'ajax_get_urls', (form_data,)
+            return 'ajax_get_url', (form_data,)
+        if 'go' in form_data:
+            return 'ajax_go_url', (form_data,)
+        if self.is_authorized:
+            return 'show_form', ()
+        return None, ()
+        #return "<pre>%s</pre>" % form_data   # for debugging
+
+    def ajax_get_url(self, form_data):
+        '''
+        If staff claimant is active, and has remote url, then return a link to this service, but with "go=<staffuser>"
+        This will let us log actual number of clicks to start video sessions.
+        '''
+        staffuser = form_data.get('get')
+        allowed, retry_after = self.get_limiter.allow(self.username)
+        if allowed:
+            data = self.get_current_url_data(staffuser)
+        else:
+            data = self.cache.get(staffuser)	# over the rate limit: answer from the cache, if possible, else 429
+            if data is None:
+                self.context['cs_handler'] = 'conditional_response'
+                self.context['content_type'] = "text/html"
+                self.context['response'] = ""
+                self.context['response_status'] = ("429", "Too Many Requests")
+                self.context['response_headers'] = {'Retry-After': str(int(retry_after) + 1)}
+                return ""
+        #if the staff member has toggled the "You are active" to True and for now, person is not affiliated with institute
+        if data.get("active") and self.is_remote:
+            html = "<button><font color='blue' size='+2'>Please <a href='%s' target='_blank'>click here to start your remote queue session</a></font></button>" % data.get("url")
+            #go_url = "%s?go=%s" % (self.my_url, staffuser)
+            #html = "<font color='blue'>Please <a href='%s' target='_blank'>click here to start your remote queue session</a></font>" % go_url
+            if self.verbose:
+                LOGGER.warn("[RemoteQueue] for user=%s, staff=%s, returning remote queue html=%s!" % (self.username, staffuser, html))
+        else:
+            html = ""
+        self.count_event("get", staffuser, bool(html))
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "text/html"
+        self.context['response'] = html
+        return ""
+
+    def ajax_get_urls(self, form_data):
+        '''
+        Batch version of ajax_get_url: form_data['get'] is a comma separated list of staff usernames.
+        Return JSON dict of username -> {'url': url, 'active': active}, where the url is only
+        given for staff who are active.  Lists of more than MAX_BATCH usernames get a 400.
+        '''
+        staffusers = [x.strip() for x in form_data.get('get').split(',') if x.strip()]
+        if len(staffusers) > self.MAX_BATCH:
+            self.context['cs_handler'] = 'conditional_response'
+            self.context['content_type'] = "text/plain"
+            self.context['response'] = "at most %d usernames per request" % self.MAX_BATCH
+            self.context['response_status'] = ("400", "Bad Request")
+            return ""
+        allowed, retry_after = self.get_limiter.allow(self.username)
+        if allowed:
+            url_data = self.get_url_data_many(staffusers)
+        else:
+            # over the rate limit: answer from the cache, if every entry is cached, else 429
+            url_data = {username: self.cache.get(username) for username in dict.fromkeys(staffusers)}
+            if None in url_data.values():
+                self.context['cs_handler'] = 'conditional_response'
+                self.context['content_type'] = "application/json"
+                self.context['response'] = ""
+                self.context['response_status'] = ("429", "Too Many Requests")
+                self.context['response_headers'] = {'Retry-After': str(int(retry_after) + 1)}
+                return ""
+        result = {}
+        for staffuser, data in url_data.items():
+            active = bool(data.get("active")) and self.is_remote
+            result[staffuser] = {'url': data.get("url") if active else None, 'active': active}
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "application/json"
+        self.context['response'] = json.dumps(result)
+        return ""
+
+    def ajax_go_url(self, form_data):
+        '''
+        If staff claimant is active, and has remote url, then return that as a HTML redirect
+        Log action
+        '''
+        staffuser = form_data.get('go')
+        data = self.get_current_url_data(staffuser)
+        #if the staff member has toggled the "You are active" to True and for now, person is not affiliated with institute
+        if data.get("active") and self.is_remote:
+            html = """<meta http-equiv="Refresh" content="0; url=%s" />""" % data.get("url")
+            if self.verbose:
+                LOGGER.warn("[RemoteQueue] GO url clicked for user=%s, staff=%s!" % (self.username, staffuser))
+        else:
+            html = ""
+        self.count_event("go", staffuser, bool(html))
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "text/html"
+        self.context['response'] = html
+        return ""
+
+    def count_event(self, event, staffuser, active):
+        '''
+        Count a student's poll ("get") or click ("go") for staffuser's url, in the analytics log;
+        events for which the staff member had no active url are counted as event + "_inactive"
+        '''
+        event = event if active else event + "_inactive"
+        self.analytics.info(event, extra={'analytics': (event, staffuser, self.username, self.context.get('cs_sid'))})
+
+    def ajax_cache_stats(self):
+        '''
+        Return url cache hit/miss counts as JSON
+        '''
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "application/json"
+        self.context['response'] = json.dumps(self.cache.stats())
+        return ""
+
+    def ajax_stats(self):
+        '''
+        Return action and csm_cslog call counts and latency histograms, in the Prometheus text format
+        '''
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "text/plain; version=0.0.4"
+        self.context['response'] = self.metrics.prometheus_text()
+        return ""
+
+    def ajax_index(self):
+        '''
+        Return INDEX_FILE: JSON of the current url and active state of each staff member
+        '''
+        try:
+            with open(os.path.expanduser(self.INDEX_FILE)) as ifp:
+                index = ifp.read()
+        except OSError:
+            index = json.dumps({'staff': {}, 'updated': None})
+        self.context['cs_handler'] = 'raw_response'
+        self.context['content_type'] = "application/json"
+        self.context['response'] = index
+        return ""
+
+    def get_current_url_data(self, username=None):
+        '''
+        Get user's current remote queue URL setting (from the url cache, if present and unexpired;
+        concurrent lookups of an uncached user share one log read)
+        '''
+        return self.cache.get_or_load(username or self.username, self.read_url_data, self.has_log)
+
+    def has_log(self, username):
+        '''
+        Return False if username has never saved url data (their log file does not exist); True if
+        they have, or if csm_cslog cannot tell
+        '''
+        get_log_filename = getattr(self.cslog, 'get_log_filename', None)
+        if get_log_filename is None:
+            return True
+        return os.path.exists(get_log_filename(self.db_name, [], username))
+
+    def read_url_data(self, username):
+        '''
+        Read user's current remote queue URL setting from the log
+        '''
+        data = self.cslog.most_recent(self.db_name, [], username)
+        if not data:
+            LOGGER.info("[RemoteQueue] no existing url for username=%s!" % (username))
+            data = {}
+        data.pop('history', None)
+        return data
+
+    def get_url_data_many(self, usernames):
+        '''
+        Get current remote queue URL settings for several users; return dict of username -> data
+        '''
+        return {username: self.get_current_url_data(username) for username in dict.fromkeys(usernames)}
+
+    def save_url_data(self, url=None, active=False):
+        '''
+        Save URL data (url and active or not), replace the cached entry, and publish it to URL_NOTIFY (if set)
+        Compact the log if COMPACT_EVERY records have been saved since it was last compacted.
+        '''
+        previous = self.cslog.most_recent(self.db_name, [], self.username, {})
+        data = {'url': url, 'active': active, 'time': time.time(), 'pending': previous.get('pending', 0) + 1}
+        with self.cache.lock(self.username):
+            self.cslog.update_log(self.db_name, [], self.username, data)
+            self.cache.put(self.username, data)
+        self.update_index(self.username, data)
+        if self.URL_NOTIFY:
+            publish_url_data(self.URL_NOTIFY, {'username': self.username, 'url': url, 'active': bool(active), 'time': data['time']},
+                             retries=self.URL_NOTIFY_RETRIES)
+        LOGGER.info("[RemoteQueue] saved data=%s for username=%s!" % (data, self.username))
+        if data['pending'] >= self.COMPACT_EVERY:
+            self.compact_log(self.username)
+
+    def compact_log(self, username):
+        '''
+        Replace username's log with a single record: the latest state, plus a "history" list of
+        earlier states (oldest first) saved within the last HISTORY_DAYS days, at most HISTORY_MAX of them.
+
+        The log is read and rewritten while holding its lock (via modify_most_recent), so that no
+        concurrent save is lost.  The latest url and active state stay at the top level of the
+        record, so readers of the most recent entry see the same data as before.
+        Returns the number of log entries that were compacted.
+        '''
+        nentries = 0
+
+        def compact(latest):
+            nonlocal nentries
+            states = []
+            for entry in self.cslog.read_log(self.db_name, [], username, lock=False):
+                nentries += 1
+                states.extend(entry.get('history', []))
+                states.append({k: entry.get(k) for k in ('url', 'active', 'time')})
+            if not states:
+                return latest
+            oldest = time.time() - self.HISTORY_DAYS * 24 * 3600
+            history = [x for x in states[:-1] if (x.get('time') or 0) >= oldest][-self.HISTORY_MAX:]
+            return dict(states[-1], history=history, pending=0)
+
+        self.cslog.modify_most_recent(self.db_name, [], username, default={}, transform_func=compact, method="overwrite")
+        LOGGER.info("[RemoteQueue] compacted %d log entries for username=%s" % (nentries, username))
+        return nentries
+
+    def update_index(self, username, data):
+        '''
+        Update INDEX_FILE, the current url and active state of each staff member, with username's
+        url data; then rewrite SNAPSHOT_FILE (accessed directly by nginx, to reduce catsoop load)
+        from it: active staff are listed with their url, inactive staff are left out.
+
+        A lock file serializes concurrent updates, and each file is written to a temporary file
+        and renamed into place, so that readers never see a partial file.  An index which does not
+        exist yet starts with the staff in the snapshot.
+        '''
+        index_fn = os.path.expanduser(self.INDEX_FILE)
+        snapshot_fn = os.path.expanduser(self.SNAPSHOT_FILE)
+        with open(snapshot_fn + ".lock", 'w') as lockfp:
+            fcntl.flock(lockfp, fcntl.LOCK_EX)
+            try:
+                with open(index_fn) as ifp:
+                    staff = json.load(ifp).get("staff", {})
+            except (OSError, ValueError):
+                staff = {user: {'url': url, 'active': True, 'time': None}
+                         for user, url in self.read_json(snapshot_fn).get("staff", {}).items()}
+            staff[username] = {'url': data.get("url"), 'active': bool(data.get("active")), 'time': data.get("time")}
+            now = time.time()
+            self.write_json(index_fn, {'staff': staff, 'updated': now}, 0o600)
+            active = {user: x['url'] for user, x in staff.items() if x.get('active') and x.get('url')}
+            self.write_json(snapshot_fn, {'staff': active, 'updated': now}, 0o644)
+
+    def read_json(self, fn):
+        try:
+            with open(fn) as ifp:
+                return json.load(ifp)
+        except (OSError, ValueError):
+            return {}
+
+    def write_json(self, fn, data, mode):
+        '''
+        Atomically replace file fn with JSON of data, readable according to mode
+        '''
+        fd, tmpfn = tempfile.mkstemp(dir=os.path.dirname(fn), suffix=".tmp")
+        with os.fdopen(fd, 'w') as ofp:
+            ofp.write(json.dumps(data))
+        os.chmod(tmpfn, mode)
+        os.replace(tmpfn, fn)
+
+    def process_form_save(self, form_data):
+        '''
+        Save data from form
+        '''
+        url = form_data.get("url")
+        active = form_data.get("active", False)
+        self.save_url_data(url, active)
+        html = "<font color='green'>saved</font>"
+        return self.show_form(extra_html=html)
+
+    def show_form(self, extra_html=""):
+        '''
+        Show input form asking for staff member's remote URL
+        '''
+        data = self.get_current_url_data()
+        active = data.get("active", "off")
+        checked = ""
+        if active in ['on']:
+            checked = " checked "
+        html = "<form method='POST'>"
+        html += '''<p>Your video url: <input type="text" size=100 value="%s" name="url"></input></p>''' % data.get("url", "")
+        html += """<p>You are active?  No <label class="switch">
+                    <input type="checkbox" name="active" %s>
+                      <span class="slider round"></span>
+                   </label> Yes</p>
+                """ % checked
+        html += '''<p><input type="submit" name="save"></input></p>'''
+        html += "</form>"
+        html += extra_html
+        return html
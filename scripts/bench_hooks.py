@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+'''bench_hooks: in-process benchmarks of the catsoop-side hot paths
+
+Runs RemoteQueue.dispatch, BroadcastMessage.dispatch, cs_post_load
+(preload.py) and the queue plugin's pre_handle, post_handle and
+post_load hooks, the way catsoop does (see catsoop_harness.py), against
+a local site filled with realistic amounts of data: many staff with
+long remote_queue logs, a long broadcast history, and lab pages with
+many questions.  Each benchmark is run --iterations times, and the
+per-call latency percentiles and memory allocated per call are reported.
+
+    scripts/bench_hooks.py                          # run everything
+    scripts/bench_hooks.py -k broadcast             # only benchmarks whose names contain "broadcast"
+    scripts/bench_hooks.py --save baseline.json     # record results
+    scripts/bench_hooks.py --compare baseline.json  # exit 1 if any p50 regressed by more than --tolerance
+
+Each benchmark times a whole request, including loading the page or
+hook code from its compiled copy and exec'ing it (which catsoop also
+does on every request).
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from catsoop_harness import Site
+
+try:
+    import bs4
+except ImportError:
+    bs4 = None
+
+#-----------------------------------------------------------------------------
+# benchmarks: each setup function fills the site with data, and returns the function to time
+
+BENCHMARKS = []
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+def student(counter=itertools.count()):
+    # a different student for each request, so that the per-user rate limits are not reached
+    return "student%06d" % next(counter)
+
+def fill_remote_queue(site, args):
+    for i in range(args.staff):
+        username = "staff%03d" % i
+        for j in range(args.log_entries):
+            site.cslog.update_log("remote_queue", [], username, {'url': 'https://zoom.example/%s' % username,
+                                                                 'active': 'on' if (i + j) % 2 else '',
+                                                                 'time': time.time()})
+    return ["staff%03d" % i for i in range(args.staff)]
+
+def fill_broadcast(site, args):
+    for i in range(args.messages):
+        site.cslog.update_log(site.course, ["broadcast_message"], "all", {'msg': 'Message number %d to the class' % i,
+                                                                          'creator': 'staff000',
+                                                                          'audience': 'all' if i % 3 else 'staff',
+                                                                          'datetime': '2020-10-01 12:00:00.000000'})
+    # publish the latest message, as the broadcast form does
+    form = {'Broadcast': 'Submit', 'msg': 'Message number %d to the class' % args.messages, 'everyone': 'on'}
+    site.run_page("broadcast", site.context("staff000", "TA", "broadcast", form))
+
+@benchmark("remote_queue get (cached)")
+def bench_rq_get_cached(site, args):
+    staff = fill_remote_queue(site, args)
+    site.run_page("remote_queue", site.context(student(), "Student", "remote_queue", {'get': staff[1]}))
+    return lambda: site.run_page("remote_queue", site.context(student(), "Student", "remote_queue", {'get': staff[1]}))
+
+@benchmark("remote_queue get (uncached)")
+def bench_rq_get_uncached(site, args):
+    staff = fill_remote_queue(site, args)
+    cache_dir = os.path.join(site.data_root, "cs_remote_queue_cache")
+    def run():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        site.run_page("remote_queue", site.context(student(), "Student", "remote_queue", {'get': staff[1]}))
+    return run
+
+@benchmark("remote_queue get (rate limited)")
+def bench_rq_get_limited(site, args):
+    staff = fill_remote_queue(site, args)
+    cache_dir = os.path.join(site.data_root, "cs_remote_queue_cache")
+    for _ in range(100):	# use up the student's burst
+        site.run_page("remote_queue", site.context("greedy", "Student", "remote_queue", {'get': staff[1]}))
+    def run():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        site.run_page("remote_queue", site.context("greedy", "Student", "remote_queue", {'get': staff[1]}))
+    return run
+
+@benchmark("remote_queue batch get")
+def bench_rq_batch_get(site, args):
+    staff = fill_remote_queue(site, args)
+    form = {'get': ",".join(staff[:args.batch])}
+    site.run_page("remote_queue", site.context(student(), "Student", "remote_queue", form))
+    return lambda: site.run_page("remote_queue", site.context(student(), "Student", "remote_queue", form))
+
+@benchmark("remote_queue show_form")
+def bench_rq_show_form(site, args):
+    fill_remote_queue(site, args)
+    return lambda: site.run_page("remote_queue", site.context("staff000", "TA", "remote_queue", {}))
+
+@benchmark("remote_queue save")
+def bench_rq_save(site, args):
+    fill_remote_queue(site, args)
+    form = {'save': 'Submit', 'url': 'https://zoom.example/staff000', 'active': 'on'}
+    return lambda: site.run_page("remote_queue", site.context("staff000", "TA", "remote_queue", form))
+
+@benchmark("broadcast get")
+def bench_bm_get(site, args):
+    fill_broadcast(site, args)
+    return lambda: site.run_page("broadcast", site.context(student(), "Student", "broadcast", {'get': ''}))
+
+@benchmark("broadcast get (rate limited)")
+def bench_bm_get_limited(site, args):
+    fill_broadcast(site, args)
+    for _ in range(100):	# use up the student's burst
+        site.run_page("broadcast", site.context("greedy", "Student", "broadcast", {'get': ''}))
+    return lambda: site.run_page("broadcast", site.context("greedy", "Student", "broadcast", {'get': ''}))
+
+@benchmark("broadcast show_form")
+def bench_bm_show_form(site, args):
+    fill_broadcast(site, args)
+    site.run_page("broadcast", site.context("staff000", "TA", "broadcast", {}))
+    return lambda: site.run_page("broadcast", site.context("staff000", "TA", "broadcast", {}))
+
+@benchmark("broadcast save")
+def bench_bm_save(site, args):
+    fill_broadcast(site, args)
+    form = {'Broadcast': 'Submit', 'msg': 'Office hours are starting now', 'everyone': 'on'}
+    return lambda: site.run_page("broadcast", site.context("staff000", "TA", "broadcast", form))
+
+@benchmark("preload cs_post_load")
+def bench_post_load(site, args):
+    return lambda: site.run_preload(site.context("student", "Student", "lab01"))
+
+def lab_page(args):
+    # cs_problem_spec and rendered cs_content for a lab page, as catsoop would produce them
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "catsoop-queue", "scripts"))
+    from bench_queue_buttons import make_page
+    content, questions = make_page(args.questions, 4000)
+    problem_spec = ["<p>Some text</p>"] + list(questions.values())
+    return content, problem_spec
+
+def plugin_context(site, args, **extra):
+    context = site.context("student", "Student", "lab01", **extra)
+    site.run_hook("pre_preload", context)
+    site.run_hook("post_auth", context)
+    return context
+
+def fill_problemstate(site, args, problem_spec):
+    for i in range(args.log_entries):
+        scores = {context['csq_name']: 1 for _, context in problem_spec[1:i + 1]}
+        site.cslog.update_log(site.course, "student", "lab01.problemstate", {'scores': scores, 'last_submit': {}})
+
+@benchmark("plugin pre_handle")
+def bench_pre_handle(site, args):
+    content, problem_spec = lab_page(args)
+    fill_problemstate(site, args, problem_spec)
+    return lambda: site.run_hook("pre_handle", plugin_context(site, args, cs_problem_spec=problem_spec))
+
+def bench_post_handle(site, args, mode):
+    content, problem_spec = lab_page(args)
+    def run():
+        context = plugin_context(site, args, cs_problem_spec=problem_spec, cs_content=content)
+        context['queue_button_injection'] = mode
+        site.run_hook("pre_handle", context)
+        site.run_hook("post_handle", context)
+    return run
+
+@benchmark("plugin pre_handle+post_handle (string)")
+def bench_post_handle_string(site, args):
+    return bench_post_handle(site, args, 'string')
+
+@benchmark("plugin pre_handle+post_handle (soup)")
+def bench_post_handle_soup(site, args):
+    if bs4 is None:
+        return None
+    return bench_post_handle(site, args, 'soup')
+
+@benchmark("plugin post_load")
+def bench_plugin_post_load(site, args):
+    return lambda: site.run_hook("post_load", plugin_context(site, args))
+
+# The plugin's per-request startup cost: all of its hooks, on a page without questions.  catsoop
+# loads each hook's compiled code on every request, so the hooks are thin shims over a module
+# imported once per worker; "plugin import" is the cost of that import, paid on a worker's first
+# request (and not again until the plugin is regenerated).
+
+def plugin_hooks(site):
+    context = site.context("student", "Student", "page")
+    for hook in ["pre_preload", "post_auth", "post_load", "pre_handle", "post_handle"]:
+        site.run_hook(hook, context)
+    return context
+
+@benchmark("plugin hooks (per request)")
+def bench_plugin_hooks(site, args):
+    return lambda: plugin_hooks(site)
+
+@benchmark("plugin import (once per worker)")
+def bench_plugin_import(site, args):
+    module = plugin_hooks(site)['queue_plugin'].__name__
+    def run():
+        sys.modules.pop(module, None)
+        site.run_hook("pre_preload", site.context("student", "Student", "page"))
+    return run
+
+#-----------------------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def measure(run, iterations):
+    '''
+    Return dict of latency percentiles (ms) and mean memory allocated per call (KiB)
+    '''
+    run()	# warm up
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    ncalls = min(iterations, 20)
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(ncalls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run()
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99), 'max': latencies[-1],
+            'alloc_kib': allocated / ncalls / 1024}
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the catsoop-side hooks and dispatchers")
+    parser.add_argument("-k", dest="filter", default="", help="only run benchmarks whose names contain this")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per benchmark (default %(default)s)")
+    parser.add_argument("--staff", type=int, default=100, help="staff with remote_queue logs (default %(default)s)")
+    parser.add_argument("--log-entries", type=int, default=200, help="entries per remote_queue and problemstate log (default %(default)s)")
+    parser.add_argument("--batch", type=int, default=50, help="staff per batch get (default %(default)s)")
+    parser.add_argument("--messages", type=int, default=5000, help="broadcast messages in the log (default %(default)s)")
+    parser.add_argument("--questions", type=int, default=50, help="questions on the lab page (default %(default)s)")
+    parser.add_argument("--save", help="save results as JSON to this file")
+    parser.add_argument("--compare", help="compare p50 latencies with results saved in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown for --compare (default %(default)s)")
+    args = parser.parse_args(args)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print("%-40s %9s %9s %9s %9s %11s" % ("benchmark", "p50 ms", "p90 ms", "p99 ms", "max ms", "alloc KiB"))
+    for name, setup in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        site = Site()
+        try:
+            run = setup(site, args)
+            if run is None:
+                print("%-40s skipped" % name)
+                continue
+            result = results[name] = measure(run, args.iterations)
+        finally:
+            shutil.rmtree(site.data_root, ignore_errors=True)
+        line = "%-40s %9.3f %9.3f %9.3f %9.3f %11.1f" % (name, result['p50'], result['p90'], result['p99'],
+                                                       result['max'], result['alloc_kib'])
+        if name in baseline:
+            change = result['p50'] / baseline[name]['p50'] - 1
+            line += "  %+.0f%%" % (100 * change)
+            if change > args.tolerance:
+                regressions.append(name)
+                line += " REGRESSION"
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+    if regressions:
+        print("p50 regressed by more than %.0f%%: %s" % (100 * args.tolerance, ", ".join(regressions)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+'''broadcast_push: push broadcast messages to browsers with Server-Sent Events
+
+This is a small asyncio service, run alongside catsoop, which holds open
+one idle HTTP connection per browser tab and sends each new broadcast
+message down those connections as soon as it is published.  This
+replaces the 1.5 second polling done by __STATIC__/broadcast.js, which
+keeps polling only as a fallback (if this service is not reachable).
+
+Endpoints:
+
+    GET  /events?token=TOKEN      event stream for the audience named in TOKEN
+    POST /notify                  re-read the message files now (sent by BroadcastMessage.save_message)
+    GET  /stats                   JSON count of connected clients
+
+The published message files, written by broadcast/broadcast_page.py, are the
+source of truth: ~/cs_broadcast.json (for everyone) is sent to "all"
+streams, and ~/cs_broadcast_staff.json (which also gets staff-only
+messages) to "staff" streams.  They are re-read on each /notify, and
+also checked for changes every --check-interval seconds, in case a
+notification is lost.
+
+A stream's audience is never taken from the client's say-so: catsoop
+(cs_add_broadcast_messaging_js in preload.py) gives each page a token
+"<audience>.<expiry>.<HMAC-SHA256>", signed with a secret key in
+--key-file which both share (whichever starts first creates it).
+/events without a token gets the "all" stream; a forged or expired
+token is refused with 403, so that broadcast.js falls back to polling
+the message file for its role.
+
+Uses only the Python standard library.  Each connection costs one
+suspended coroutine and its socket buffers, so tens of thousands of
+idle connections are cheap.  Raise the open file limit (ulimit -n)
+accordingly.
+
+Example nginx configuration:
+
+    location /msg/broadcast_events {
+        proxy_pass http://127.0.0.1:3200/events;
+        proxy_http_version 1.1;
+        proxy_set_header Connection '';
+        proxy_buffering off;
+        proxy_read_timeout 1h;
+    }
+'''
+import os
+import sys
+import hmac
+import json
+import time
+import hashlib
+import asyncio
+import logging
+import argparse
+import urllib.parse
+
+# the key is read (or created) by the same code as in catsoop, from the top-level preload.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from preload import BROADCAST_PUSH_KEY_FILE, broadcast_push_key
+
+LOGGER = logging.getLogger("broadcast_push")
+
+SSE_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+               b"Content-Type: text/event-stream\r\n"
+               b"Cache-Control: no-cache\r\n"
+               b"X-Accel-Buffering: no\r\n"
+               b"Connection: keep-alive\r\n"
+               b"\r\n"
+               b"retry: 5000\n\n")
+
+#-----------------------------------------------------------------------------
+
+class BroadcastPush:
+
+    AUDIENCES = ['all', 'staff']
+    MAX_WRITE_BUFFER = 64 * 1024	# drop clients which stop reading
+    HEADER_TIMEOUT = 10			# seconds allowed for a client to send its request headers
+
+    def __init__(self, msg_files, key, check_interval=5, keepalive_interval=30):
+        self.msg_files = msg_files	# audience -> published message file
+        self.key = key			# secret shared with catsoop, for checking tokens
+        self.check_interval = check_interval
+        self.keepalive_interval = keepalive_interval
+        self.clients = {audience: set() for audience in self.AUDIENCES}
+        self.messages = {audience: None for audience in self.AUDIENCES}
+        self.message_stats = {audience: None for audience in self.AUDIENCES}
+
+    def token_audience(self, token):
+        '''
+        Return the audience of a valid, unexpired token made by catsoop's broadcast_events_token, or None
+        '''
+        try:
+            audience, expiry, signature = token.split(".")
+            expiry = int(expiry)
+            payload = ("%s.%d" % (audience, expiry)).encode("ascii")
+            signature = signature.encode("ascii")
+        except ValueError:	# including UnicodeEncodeError, for tokens which are not ASCII
+            return None
+        expected = hmac.new(self.key, payload, hashlib.sha256).hexdigest().encode("ascii")
+        if not hmac.compare_digest(expected, signature) or expiry < time.time() or audience not in self.clients:
+            return None
+        return audience
+
+    def load_message(self, audience):
+        '''
+        Re-read audience's message file if it has changed; return True if there is a new message
+        '''
+        fn = self.msg_files[audience]
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return False
+        stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stat == self.message_stats[audience]:
+            return False
+        try:
+            with open(fn) as ifp:
+                message = json.load(ifp)
+        except (OSError, ValueError) as err:
+            LOGGER.warning("failed to read %s, err=%s" % (fn, err))
+            return False
+        self.message_stats[audience] = stat
+        if message == self.messages[audience]:
+            return False
+        self.messages[audience] = message
+        return True
+
+    def event(self, audience):
+        '''
+        Return SSE event (bytes) for audience's current message, or None if there is nothing to send
+        '''
+        message = self.messages[audience]
+        if not message:
+            return None
+        lines = ["id: %s" % message.get("version", ""),
+                 "data: %s" % json.dumps(message)]
+        return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+    def send(self, writer, data):
+        if writer.is_closing() or writer.transport.get_write_buffer_size() > self.MAX_WRITE_BUFFER:
+            writer.close()
+            return
+        writer.write(data)
+
+    def fan_out(self, audience):
+        data = self.event(audience)
+        if data is None:
+            return
+        clients = self.clients[audience]
+        for writer in list(clients):
+            self.send(writer, data)
+        LOGGER.info("sent message version=%s to %d %s clients" % (self.messages[audience].get("version"),
+                                                                  len(clients), audience))
+
+    def stats(self):
+        return {audience: len(clients) for audience, clients in self.clients.items()}
+
+    def check(self):
+        for audience in self.AUDIENCES:
+            if self.load_message(audience):
+                self.fan_out(audience)
+
+    async def watch(self):
+        '''
+        Fallback for lost notifications: periodically check the message file for changes
+        '''
+        while True:
+            await asyncio.sleep(self.check_interval)
+            self.check()
+
+    async def keepalive(self):
+        '''
+        Send an SSE comment to every client, so that proxies do not time out idle connections
+        '''
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            for clients in self.clients.values():
+                for writer in list(clients):
+                    self.send(writer, b": ping\n\n")
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.HEADER_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        try:
+            method, target = lines[0].split(" ")[:2]
+        except ValueError:
+            self.respond(writer, "400 Bad Request", b"bad request\n")
+            return
+        headers = dict(line.split(":", 1) for line in lines[1:] if ":" in line)
+        headers = {k.strip().lower(): v.strip() for k, v in headers.items()}
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+
+        if url.path == "/events" and method == "GET":
+            token = query.get("token", [None])[0]
+            audience = self.token_audience(token) if token else "all"
+            if audience is None:
+                self.respond(writer, "403 Forbidden", b"invalid or expired token\n")
+                return
+            await self.stream(reader, writer, audience, headers.get("last-event-id"))
+        elif url.path == "/notify" and method == "POST":
+            self.check()
+            self.respond(writer, "204 No Content", b"")
+        elif url.path == "/stats" and method == "GET":
+            self.respond(writer, "200 OK", json.dumps(self.stats()).encode("utf-8"), "application/json")
+        else:
+            self.respond(writer, "404 Not Found", b"not found\n")
+
+    def respond(self, writer, status, body, content_type="text/plain"):
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                      % (status, content_type, len(body))).encode("latin-1") + body)
+        writer.close()
+
+    async def stream(self, reader, writer, audience, last_event_id=None):
+        '''
+        Hold an event stream open until the client disconnects
+        '''
+        writer.write(SSE_HEADERS)
+        data = self.event(audience)
+        if data is not None and last_event_id != str(self.messages[audience].get("version", "")):
+            writer.write(data)
+        clients = self.clients[audience]
+        clients.add(writer)
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    async def serve(self, host, port):
+        for audience in self.AUDIENCES:
+            self.load_message(audience)
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        LOGGER.info("listening on %s:%s for %s" % (host, port, self.msg_files))
+        asyncio.ensure_future(self.watch())
+        asyncio.ensure_future(self.keepalive())
+        async with server:
+            await server.serve_forever()
+
+#-----------------------------------------------------------------------------
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Push catsoop broadcast messages to browsers via Server-Sent Events")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default %(default)s)")
+    parser.add_argument("--port", type=int, default=3200, help="port to listen on (default %(default)s)")
+    parser.add_argument("--msg-file", default="~/cs_broadcast.json", help="published broadcast message file for everyone (default %(default)s)")
+    parser.add_argument("--staff-msg-file", default="~/cs_broadcast_staff.json", help="published broadcast message file for staff (default %(default)s)")
+    parser.add_argument("--key-file", default=BROADCAST_PUSH_KEY_FILE, help="secret key shared with catsoop, for stream tokens (default %(default)s)")
+    parser.add_argument("--check-interval", type=float, default=5, help="seconds between checks of the message file (default %(default)s)")
+    parser.add_argument("--keepalive-interval", type=float, default=30, help="seconds between keepalive comments (default %(default)s)")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    msg_files = {'all': os.path.expanduser(args.msg_file), 'staff': os.path.expanduser(args.staff_msg_file)}
+    push = BroadcastPush(msg_files, broadcast_push_key(args.key_file), args.check_interval, args.keepalive_interval)
+    try:
+        asyncio.run(push.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+'''catsoop_harness: run this repository's catsoop code outside of catsoop
+
+catsoop runs remote_queue/content.py, broadcast/content.py, preload.py
+and the queue plugin hooks by exec'ing them in a context dict holding
+the request's globals (cs_user_info, cs_form, csm_cslog, ...).  This
+module builds such contexts, with a file-backed stand-in for
+csm_cslog, so that those files can be benchmarked and load tested
+locally (see bench_hooks.py and load_test.py).  The queue plugin is
+generated into the site's course directory by make_catsoop.py's
+render_plugin, and the remote_queue and broadcast pages are linked
+into it, as for a real course, so that the plugin hooks and the pages
+import their modules as they do in production.
+
+LocalCSLog stores logs the way catsoop's filesystem backend does (each
+entry is a pickle, with its length before and after it), so reads of
+most_recent cost about what they do in production.
+'''
+import os
+import sys
+import fcntl
+import pickle
+import marshal
+import logging
+import struct
+import tempfile
+import contextlib
+import urllib.parse
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PLUGIN_TEMPLATE = os.path.join(REPO_ROOT, "catsoop-queue", "catsoop", "plugin-template")
+PLUGIN_NAME = "queue"
+PAGES = ["remote_queue", "broadcast"]
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "catsoop-queue", "scripts"))
+import make_catsoop
+
+#-----------------------------------------------------------------------------
+
+class LocalCSLog:
+    '''
+    File-backed stand-in for catsoop's csm_cslog module, storing logs under data_root
+    '''
+
+    def __init__(self, data_root):
+        self.data_root = data_root
+
+    def get_log_filename(self, db_name, path, logname):
+        parts = [urllib.parse.quote(x, safe='') for x in [db_name] + list(path) + [logname]]
+        return os.path.join(self.data_root, "_logs", *parts[:-1], parts[-1] + ".log")
+
+    @contextlib.contextmanager
+    def log_lock(self, fname, lock=True):
+        if not lock:
+            yield
+            return
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname + ".lock", 'w') as lockfp:
+            fcntl.flock(lockfp, fcntl.LOCK_EX)
+            yield
+
+    def _modify_log(self, fname, new, mode):
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        entry = pickle.dumps(new, -1)
+        length = struct.pack("<Q", len(entry))
+        with open(fname, mode) as f:
+            f.write(length + entry + length)
+
+    def update_log(self, db_name, path, logname, new, lock=True):
+        fname = self.get_log_filename(db_name, path, logname)
+        with self.log_lock(fname, lock):
+            self._modify_log(fname, new, "ab")
+
+    def overwrite_log(self, db_name, path, logname, new, lock=True):
+        fname = self.get_log_filename(db_name, path, logname)
+        with self.log_lock(fname, lock):
+            self._modify_log(fname, new, "wb")
+
+    def read_log(self, db_name, path, logname, lock=True):
+        fname = self.get_log_filename(db_name, path, logname)
+        entries = []
+        with self.log_lock(fname, lock):
+            try:
+                with open(fname, "rb") as f:
+                    while True:
+                        raw = f.read(8)
+                        if len(raw) < 8:
+                            break
+                        length = struct.unpack("<Q", raw)[0]
+                        entries.append(pickle.loads(f.read(length)))
+                        f.seek(8, os.SEEK_CUR)
+            except FileNotFoundError:
+                pass
+        return entries
+
+    def most_recent(self, db_name, path, logname, default=None, lock=True):
+        fname = self.get_log_filename(db_name, path, logname)
+        with self.log_lock(fname, lock):
+            try:
+                with open(fname, "rb") as f:
+                    f.seek(-8, os.SEEK_END)
+                    length = struct.unpack("<Q", f.read(8))[0]
+                    f.seek(-length - 8, os.SEEK_CUR)
+                    return pickle.loads(f.read(length))
+            except (FileNotFoundError, OSError):
+                return default
+
+    def modify_most_recent(self, db_name, path, logname, default=None, transform_func=lambda x: x,
+                           method="update", lock=True):
+        fname = self.get_log_filename(db_name, path, logname)
+        with self.log_lock(fname, lock):
+            new = transform_func(self.most_recent(db_name, path, logname, default, lock=False))
+            (self.update_log if method == "update" else self.overwrite_log)(db_name, path, logname, new, lock=False)
+        return new
+
+#-----------------------------------------------------------------------------
+
+class Site:
+    '''
+    A local catsoop "site": a data directory (also used as $HOME, where the pages keep their
+    shared files such as ~/cs_broadcast.json), a LocalCSLog, the queue plugin generated into
+    data_root/courses/<course>/__PLUGINS__/queue, the repository's pages linked into
+    data_root/courses/<course>, and cached compiled copies of the pages and the plugin hooks.
+    '''
+
+    def __init__(self, data_root=None, course="6.036", url_root="https://localhost/cs", plugin_params=None):
+        self.data_root = data_root or tempfile.mkdtemp(prefix="cs_harness_")
+        os.environ['HOME'] = self.data_root
+        self.course = course
+        self.url_root = url_root
+        self.cslog = LocalCSLog(self.data_root)
+        self.plugin_params = dict(queue_room=repr('default'), queue_url_root=repr('https://localhost/queue'),
+                                  queue_css_tags=repr(''), queue_js_tags=repr(''), broadcast_asset_tags=repr(None))
+        self.plugin_params.update(plugin_params or {})
+        self.plugin_dir = os.path.join(self.data_root, "courses", course, "__PLUGINS__", PLUGIN_NAME)
+        self.render_plugin()
+        self.course_dir = os.path.join(self.data_root, "courses", course)
+        for page in PAGES:
+            if not os.path.lexists(os.path.join(self.course_dir, page)):
+                os.symlink(os.path.join(REPO_ROOT, page), os.path.join(self.course_dir, page))
+        self.code = {}
+        # as in catsoop, the pages' "cs" log messages go to a file
+        handler = logging.FileHandler(os.path.join(self.data_root, "cs.log"))
+        logging.getLogger("cs").handlers = [handler]
+        logging.getLogger("cs").propagate = False
+
+    def render_plugin(self):
+        '''
+        Generate the queue plugin (its hooks and module) into plugin_dir, as make_catsoop.py does
+        '''
+        outputs = make_catsoop.render_plugin(PLUGIN_TEMPLATE, self.plugin_dir, self.plugin_params, PLUGIN_NAME)
+        for fname, content in outputs.items():
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(fname, 'w') as f:
+                f.write(content)
+
+    def compile(self, fname):
+        '''
+        Return the code of fname, loaded as catsoop's loader does on every request: unmarshalled
+        from a compiled copy in data_root/_cached (written when fname is first used)
+        '''
+        cached = self.code.get(fname)
+        if cached is None:
+            with open(fname) as f:
+                code = compile(f.read(), fname, 'exec')
+            cached = os.path.join(self.data_root, "_cached", "%d.pyc" % len(self.code))
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            with open(cached, 'wb') as f:
+                marshal.dump(code, f)
+            self.code[fname] = cached
+        with open(cached, 'rb') as f:
+            return marshal.load(f)
+
+    def context(self, username, role, page, form=None, env=None, **extra):
+        '''
+        Return a new request context, as catsoop would set up for username (with role) viewing page
+        '''
+        context = {
+            'cs_username': username,
+            'cs_sid': "sid-%s" % username,
+            'cs_user_info': {'username': username, 'role': role},
+            'cs_form': {} if form is None else form,
+            'cs_env': env or {},
+            'csm_cslog': self.cslog,
+            'cs_course': self.course,
+            '_course_number': self.course,
+            'cs_url_root': self.url_root,
+            'cs_path_info': [self.course] + page.split("/"),
+            'cs_data_root': self.data_root,
+            'cs_scripts': '',
+            'cs_content': '',
+        }
+        context.update(extra)
+        return context
+
+    def run_page(self, page, context):
+        '''
+        Run the top-level preload.py, then the content.py of page (e.g. "remote_queue"), in context; return context
+        '''
+        exec(self.compile(os.path.join(REPO_ROOT, "preload.py")), context)
+        exec(self.compile(os.path.join(self.course_dir, page, "content.py")), context)
+        return context
+
+    def run_preload(self, context):
+        '''
+        Run the top-level preload.py and its cs_post_load in context; return context
+        '''
+        exec(self.compile(os.path.join(REPO_ROOT, "preload.py")), context)
+        context['cs_post_load'](context)
+        return context
+
+    def run_hook(self, hook, context):
+        '''
+        Run the generated queue plugin hook (e.g. "pre_handle") in context; return context
+        '''
+        exec(self.compile(os.path.join(self.plugin_dir, hook + ".py")), context)
+        return context
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''compact_remote_queue: one-shot compaction of existing remote_queue logs
+
+Saving a video URL compacts a staff member's remote_queue log every
+RemoteQueue.COMPACT_EVERY saves (see remote_queue/remote_queue_page.py).  Logs
+written before that existed can be compacted with this script, which
+runs RemoteQueue.compact_log for each given staff username, using the
+catsoop installation's cslog.  Run it as the user running catsoop:
+
+    python3 scripts/compact_remote_queue.py --catsoop /path/to/cat-soop alice bob
+    python3 scripts/compact_remote_queue.py --catsoop /path/to/cat-soop --all
+
+--all compacts every log in the remote_queue database directory; it
+cannot be used if catsoop is configured to encrypt logs, since the log
+filenames are then hashed.  Compaction is safe to run while catsoop is
+serving requests.
+
+Each compacted staff member's latest state is also added to the staff
+index (RemoteQueue.INDEX_FILE), so that staff who have not saved their
+url since the index was introduced are listed in it.
+'''
+import os
+import sys
+import argparse
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_remote_queue(cslog):
+    '''
+    Return a RemoteQueue (from remote_queue/remote_queue_page.py) for cslog, with just enough of
+    catsoop's request context to make one; RequestMetrics and RateLimiter come from preload.py
+    '''
+    sys.path.insert(0, REPO_ROOT)
+    import preload
+    sys.path.insert(0, os.path.join(REPO_ROOT, "remote_queue"))	# after importing the top-level preload.py, not the page's
+    import remote_queue_page
+    context = {
+        'cs_user_info': {},
+        'cs_username': None,
+        'cs_url_root': '',
+        'cs_path_info': [],
+        'csm_cslog': cslog,
+        'RequestMetrics': preload.RequestMetrics,
+        'RateLimiter': preload.RateLimiter,
+    }
+    return remote_queue_page.RemoteQueue(context)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compact remote_queue logs to their latest state plus bounded history")
+    parser.add_argument("--catsoop", help="directory containing the catsoop package (if not already importable)")
+    parser.add_argument("--all", action="store_true", help="compact the logs of all staff in the remote_queue database")
+    parser.add_argument("usernames", nargs="*", help="staff usernames whose logs should be compacted")
+    args = parser.parse_args(args)
+
+    if args.catsoop:
+        sys.path.append(args.catsoop)
+    import catsoop.cslog as cslog
+
+    rq = load_remote_queue(cslog)
+    usernames = list(args.usernames)
+    if args.all:
+        if cslog.ENCRYPT_KEY is not None:
+            parser.error("--all cannot be used with encrypted logs; give usernames instead")
+        logdir = os.path.dirname(cslog.get_log_filename(rq.db_name, [], "x"))
+        usernames += sorted(fn[:-4] for fn in os.listdir(logdir) if fn.endswith(".log"))
+    if not usernames:
+        parser.error("no usernames given")
+
+    total = 0
+    for username in usernames:
+        nentries = rq.compact_log(username)
+        latest = cslog.most_recent(rq.db_name, [], username, {})
+        if latest:
+            rq.update_index(username, latest)
+        print("%s: compacted %d entries" % (username, nentries))
+        total += nentries
+    print("compacted %d entries in %d logs" % (total, len(usernames)))
+
+if __name__ == "__main__":
+    main()
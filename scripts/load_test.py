@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+'''load_test: find the load at which the catsoop-side pages saturate
+
+Serves the remote_queue and broadcast pages (content.py) from a local
+site (see catsoop_harness.py) behind CatsoopApp, a minimal WSGI stand-in
+for catsoop, run by --workers pre-forked processes (each with a pool of
+threads), as catsoop is run in production.  Then simulates, for each
+number of students given by --students, for --duration seconds:
+
+  - each student polling broadcast?get on broadcast.js's schedule: every
+    1.5 s while a message is live, else backing off up to 30 s, and
+    following the X-Next-Poll-Ms and 429 responses of the server
+  - students' tickets being claimed, each student looking up the
+    claimant's url with remote_queue?get, --claims times per minute
+  - --staff staff members saving their url, toggling "active", every
+    --toggle-every seconds
+  - a broadcast to everyone every --broadcast-every seconds
+
+and reports the throughput, latency percentiles and error rate (5xx
+responses, failed connections and timeouts) of each step, per endpoint
+with -v.  A step is marked saturated when its error rate is over 1%, or
+its p99 latency is over --slo-ms.
+
+    python3 scripts/load_test.py --students 100,200,400,800,1600
+    python3 scripts/load_test.py --students 500 --duration 60 --workers 8 -v --save results.json
+
+The students are asyncio tasks in this process.  "client lag" is how
+late their timers fire; if it grows to hundreds of ms, this process is
+the bottleneck, and the results understate what the server can do.
+'''
+import os
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import asyncio
+import argparse
+import traceback
+import socketserver
+import urllib.parse
+import importlib.util
+import wsgiref.simple_server
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from catsoop_harness import Site, REPO_ROOT
+
+PAGES = ["remote_queue", "broadcast"]
+
+#-----------------------------------------------------------------------------
+# catsoop stand-in
+
+class CatsoopApp:
+    '''
+    WSGI application running the pages of a harness Site, the way catsoop would, at /<course>/<page>
+
+    The user is given by the X-CS-User and X-CS-Role request headers (in place of catsoop's
+    login).  Responses of pages which set cs_handler are made by catsoop's raw_response
+    handler, or by conditional_response from __HANDLERS__; otherwise the page's
+    cs_problem_spec is returned as HTML.
+    '''
+
+    def __init__(self, site):
+        self.site = site
+        spec = importlib.util.spec_from_file_location(
+            "conditional_response", os.path.join(REPO_ROOT, "__HANDLERS__", "conditional_response", "conditional_response.py"))
+        self.conditional_response = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.conditional_response)
+
+    def __call__(self, environ, start_response):
+        try:
+            status, headers, body = self.handle(environ)
+        except Exception:
+            traceback.print_exc()
+            status, headers, body = ("500", "Internal Server Error"), {"Content-type": "text/plain"}, b"error"
+        start_response("%s %s" % status, list(headers.items()))
+        return [body]
+
+    def handle(self, environ):
+        path = [x for x in environ.get("PATH_INFO", "").split("/") if x]
+        if len(path) != 2 or path[0] != self.site.course or path[1] not in PAGES:
+            return ("404", "Not Found"), {"Content-type": "text/plain"}, b"not found"
+        form = dict(urllib.parse.parse_qsl(environ.get("QUERY_STRING", ""), keep_blank_values=True))
+        if environ.get("REQUEST_METHOD") == "POST":
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            form.update(urllib.parse.parse_qsl(environ["wsgi.input"].read(length).decode("utf-8"), keep_blank_values=True))
+        username = environ.get("HTTP_X_CS_USER", "student")
+        role = environ.get("HTTP_X_CS_ROLE", "Student")
+        context = self.site.run_page(path[1], self.site.context(username, role, path[1], form, env=environ))
+        handler = context.get("cs_handler")
+        if handler == "conditional_response":
+            return self.conditional_response.handle(context)
+        if handler == "raw_response":
+            body = context["response"]
+            body = body.encode("utf-8") if isinstance(body, str) else body
+            return ("200", "OK"), {"Content-type": context.get("content_type", "text/plain"),
+                                   "Content-length": str(len(body))}, body
+        body = str(context.get("cs_problem_spec", "")).encode("utf-8")
+        return ("200", "OK"), {"Content-type": "text/html", "Content-length": str(len(body))}, body
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+def serve(app, workers):
+    '''
+    Serve app on a free local port, in workers forked processes; return (port, list of worker pids)
+    '''
+    server = wsgiref.simple_server.make_server("127.0.0.1", 0, app, server_class=ThreadingWSGIServer,
+                                               handler_class=QuietHandler)
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    port = server.server_address[1]
+    server.server_close()
+    return port, pids
+
+#-----------------------------------------------------------------------------
+# simulated users
+
+class Stats:
+    '''
+    Latencies (ms) and outcomes of the requests made in a step, per endpoint
+    '''
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.limited = {}
+        self.lag = []
+
+    def add(self, endpoint, ms, status):
+        self.latencies.setdefault(endpoint, []).append(ms)
+        if status is None or status >= 500:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        elif status == 429:
+            self.limited[endpoint] = self.limited.get(endpoint, 0) + 1
+
+    def summary(self, duration, endpoint=None):
+        endpoints = [endpoint] if endpoint else list(self.latencies)
+        latencies = sorted(x for e in endpoints for x in self.latencies.get(e, []))
+        n = len(latencies)
+        if not n:
+            return None
+        pct = lambda f: latencies[min(n - 1, int(f * n))]
+        return {'requests': n, 'rps': n / duration, 'p50': pct(0.5), 'p90': pct(0.9), 'p99': pct(0.99),
+                'max': latencies[-1], 'error_rate': sum(self.errors.get(e, 0) for e in endpoints) / n,
+                'limited_rate': sum(self.limited.get(e, 0) for e in endpoints) / n}
+
+    def lag_p99(self):
+        lag = sorted(self.lag)
+        return lag[min(len(lag) - 1, int(0.99 * len(lag)))] if lag else 0
+
+class LoadTest:
+    '''
+    Simulated students and staff, making requests to the server at port for one step
+    '''
+
+    def __init__(self, port, course, args):
+        self.port = port
+        self.course = course
+        self.args = args
+        self.staff = ["staff%03d" % i for i in range(args.staff)]
+
+    async def request(self, endpoint, user, role, page, query="", form=None, headers=None):
+        '''
+        Make one HTTP request; return (status, lowercased headers dict, body), status None on failure
+        '''
+        body = urllib.parse.urlencode(form).encode("utf-8") if form is not None else b""
+        lines = ["%s /%s/%s%s HTTP/1.0" % ("POST" if form is not None else "GET", self.course, page,
+                                           "?" + query if query else ""),
+                 "Host: 127.0.0.1", "X-CS-User: %s" % user, "X-CS-Role: %s" % role]
+        if form is not None:
+            lines += ["Content-Type: application/x-www-form-urlencoded", "Content-Length: %d" % len(body)]
+        lines += ["%s: %s" % x for x in (headers or {}).items()]
+        start = time.perf_counter()
+        status, rheaders, rbody = None, {}, b""
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", self.port), self.args.timeout)
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+            raw = await asyncio.wait_for(reader.read(), self.args.timeout)
+            head, _, rbody = raw.partition(b"\r\n\r\n")
+            head = head.decode("latin-1").split("\r\n")
+            status = int(head[0].split()[1])
+            rheaders = dict((k.strip().lower(), v.strip()) for k, _, v in (x.partition(":") for x in head[1:]))
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            status = None
+        finally:
+            if writer is not None:
+                writer.close()
+        self.stats.add(endpoint, (time.perf_counter() - start) * 1000, status)
+        return status, rheaders, rbody
+
+    async def sleep(self, seconds):
+        '''
+        Sleep, recording how late the wakeup was; return False once the step is over
+        '''
+        seconds = min(seconds, max(self.stop - time.monotonic(), 0))
+        wake = time.monotonic() + seconds
+        await asyncio.sleep(seconds)
+        self.stats.lag.append((time.monotonic() - wake) * 1000)
+        return time.monotonic() < self.stop
+
+    async def student(self, username):
+        '''
+        Poll broadcast?get the way broadcast.js does
+        '''
+        live_ms, idle_max_ms = 1500, 30000
+        delay = live_ms
+        etag = None
+        expires = 0
+        errors = 0
+        if not await self.sleep(random.uniform(0, live_ms / 1000)):
+            return
+        while errors < 20:	# broadcast.js stops polling after 20 errors
+            status, headers, body = await self.request("broadcast?get", username, "Student", "broadcast", "get",
+                                                       headers={"If-None-Match": etag} if etag else None)
+            if status == 200:
+                etag = headers.get("etag")
+                try:
+                    expires = json.loads(body).get("expires") or 0
+                except (ValueError, AttributeError):
+                    pass
+            if status in (200, 304, 429):
+                errors = 0
+            else:
+                errors += 1
+            hint = int(headers.get("x-next-poll-ms") or 0)
+            if status == 429:
+                delay = max(delay, hint or idle_max_ms)
+            elif time.time() < expires:
+                delay = hint or live_ms
+            else:
+                delay = min(delay * 2, hint or idle_max_ms)
+            if not await self.sleep(delay / 1000):
+                return
+
+    async def claims(self, nstudents):
+        '''
+        Look up claimants' urls, as students' queue pages do when their ticket is claimed
+        '''
+        rate = nstudents * self.args.claims / 60
+        tasks = []
+        while await self.sleep(random.expovariate(rate)):
+            username = "student%05d" % random.randrange(nstudents)
+            tasks.append(asyncio.ensure_future(self.request("remote_queue?get", username, "Student", "remote_queue",
+                                                            "get=" + random.choice(self.staff))))
+        await asyncio.gather(*tasks)
+
+    async def staff_member(self, username):
+        '''
+        Save a url, toggling "active", every --toggle-every seconds
+        '''
+        active = True
+        while await self.sleep(random.uniform(0.5, 1.5) * self.args.toggle_every):
+            form = {'save': 'Submit', 'url': 'https://zoom.example/%s' % username}
+            if active:
+                form['active'] = 'on'
+            await self.request("remote_queue save", username, "TA", "remote_queue", form=form)
+            active = not active
+
+    async def broadcaster(self):
+        '''
+        Send a broadcast to everyone every --broadcast-every seconds
+        '''
+        n = 0
+        while await self.sleep(self.args.broadcast_every):
+            n += 1
+            form = {'Broadcast': 'Submit', 'msg': 'Load test message %d' % n, 'everyone': 'on'}
+            await self.request("broadcast save", "staff000", "TA", "broadcast", form=form)
+
+    async def run(self, nstudents):
+        self.stats = Stats()
+        self.stop = time.monotonic() + self.args.duration
+        tasks = [self.student("student%05d" % i) for i in range(nstudents)]
+        tasks += [self.staff_member(username) for username in self.staff]
+        tasks += [self.claims(nstudents), self.broadcaster()]
+        await asyncio.gather(*tasks)
+        return self.stats
+
+#-----------------------------------------------------------------------------
+
+def print_row(label, summary, lag=None, saturated=False):
+    line = "%-22s %8d %8.1f %8.1f %8.1f %8.1f %8.1f %7.2f%% %7.2f%%" % (
+        label, summary['requests'], summary['rps'], summary['p50'], summary['p90'], summary['p99'],
+        summary['max'], 100 * summary['error_rate'], 100 * summary['limited_rate'])
+    if lag is not None:
+        line += " %8.1f" % lag
+    if saturated:
+        line += "  SATURATED"
+    print(line, flush=True)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Load test the remote_queue and broadcast pages behind a catsoop stand-in")
+    parser.add_argument("--students", default="100,200,400,800", help="comma separated numbers of students, one step each (default %(default)s)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per step (default %(default)s)")
+    parser.add_argument("--staff", type=int, default=20, help="staff saving their url (default %(default)s)")
+    parser.add_argument("--toggle-every", type=float, default=60, help="mean seconds between each staff member's saves (default %(default)s)")
+    parser.add_argument("--broadcast-every", type=float, default=20, help="seconds between broadcasts (default %(default)s)")
+    parser.add_argument("--claims", type=float, default=0.5, help="claimant url lookups per student per minute (default %(default)s)")
+    parser.add_argument("--workers", type=int, default=4, help="server processes (default %(default)s)")
+    parser.add_argument("--timeout", type=float, default=10, help="request timeout in seconds (default %(default)s)")
+    parser.add_argument("--slo-ms", type=float, default=500, help="p99 latency above which a step is saturated (default %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="also report each endpoint")
+    parser.add_argument("--save", help="save results as JSON to this file")
+    args = parser.parse_args(args)
+
+    site = Site()
+    port, pids = serve(CatsoopApp(site), args.workers)
+    test = LoadTest(port, site.course, args)
+    results = {}
+    try:
+        print("%-22s %8s %8s %8s %8s %8s %8s %8s %8s %8s" % ("students / endpoint", "requests", "req/s", "p50 ms", "p90 ms",
+                                                             "p99 ms", "max ms", "errors", "429s", "lag ms"))
+        for nstudents in [int(x) for x in args.students.split(",")]:
+            stats = asyncio.run(test.run(nstudents))
+            summary = stats.summary(args.duration)
+            if summary is None:
+                continue
+            summary['client_lag_p99'] = stats.lag_p99()
+            summary['endpoints'] = {e: stats.summary(args.duration, e) for e in sorted(stats.latencies)}
+            saturated = summary['error_rate'] > 0.01 or summary['p99'] > args.slo_ms
+            results[nstudents] = summary
+            print_row("%d students" % nstudents, summary, summary['client_lag_p99'], saturated)
+            if args.verbose:
+                for endpoint, esummary in summary['endpoints'].items():
+                    print_row("  " + endpoint, esummary)
+    finally:
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        shutil.rmtree(site.data_root, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
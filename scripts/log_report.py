@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+'''log_report: per-staff remote queue and broadcast reports, streamed from the logs
+
+Reads, one entry at a time:
+
+  - the remote_queue logs (one per staff member, see remote_queue/remote_queue_page.py),
+    for saves and active hours of each staff member
+  - the remote queue analytics log (RemoteQueue.ANALYTICS_LOG), for student
+    url polls (?get), click-throughs (?go) and remote sessions per staff member
+  - the broadcast_message "all" log of each course, for the reach (audience
+    and courses) of each broadcast
+
+and writes a CSV or JSON report, of staff members (--report staff) or of
+broadcasts (--report broadcast):
+
+    python3 scripts/log_report.py --catsoop /path/to/cat-soop
+    python3 scripts/log_report.py --catsoop /path/to/cat-soop --report broadcast --format json
+    python3 scripts/log_report.py --catsoop /path/to/cat-soop --state ~/cs_log_report.json
+
+Logs are never loaded whole: entries are read by generators, and only
+running totals are kept (per staff member, per student who clicked
+through, and per broadcast), so memory does not grow with log length.
+
+With --state, the totals and the offset reached in each log are saved to
+the given file, and the next run continues from there, reading only new
+entries.  Logs which were rewritten since (a compacted remote_queue log,
+or a rotated analytics log) are read again from the start; url states
+already counted (by their save time) are skipped.
+
+A staff member's active hours add up the time from each save with
+"active" on to the next save; each such interval counts for at most
+--max-active hours, in case someone forgot to turn "active" off.  A
+remote session is a student's click-through to a staff member's url,
+more than --session-gap minutes after their previous one.
+
+--data-root reads logs written by scripts/catsoop_harness.py instead of
+catsoop's, e.g. after running the benchmarks or load tests.
+'''
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import pickle
+import struct
+import argparse
+
+REMOTE_QUEUE_DB = "remote_queue"
+BROADCAST_DB = "broadcast_message"
+
+#-----------------------------------------------------------------------------
+# streaming readers
+
+def iter_log(fname, offset=0, unprep=pickle.loads):
+    '''
+    Yield (offset after entry, entry) for each complete entry of the cslog file fname, starting at offset
+    Each entry is stored with its length before and after it; an entry still being written ends the log.
+    '''
+    with open(fname, 'rb') as ifp:
+        ifp.seek(offset)
+        while True:
+            raw = ifp.read(8)
+            if len(raw) < 8:
+                return
+            length = struct.unpack("<Q", raw)[0]
+            data = ifp.read(length)
+            if len(data) < length or len(ifp.read(8)) < 8:
+                return
+            offset += length + 16
+            yield offset, unprep(data)
+
+def iter_lines(fname, offset=0):
+    '''
+    Yield (offset after line, JSON of line) for each complete line of fname, starting at offset
+    '''
+    with open(fname, 'rb') as ifp:
+        ifp.seek(offset)
+        for line in ifp:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            try:
+                yield offset, json.loads(line)
+            except ValueError:
+                continue
+
+#-----------------------------------------------------------------------------
+# running totals
+
+class LogReport:
+    '''
+    Running totals of staff activity and broadcasts, read incrementally from logs
+
+    self.state is JSON serializable: it holds the totals, and the offset reached in each log
+    file (with the file's inode and a hash of its first bytes, to notice files which were rewritten).
+    '''
+
+    def __init__(self, state=None, session_gap=30 * 60, max_active=8 * 3600):
+        self.state = state or {'files': {}, 'staff': {}, 'broadcasts': {}}
+        self.session_gap = session_gap
+        self.max_active = max_active
+
+    def read(self, fname, reader, **kwargs):
+        '''
+        Yield the new items of file fname from reader (iter_log or iter_lines), recording the offset
+        reached; returns at once if the file is missing.  If the file was replaced or rewritten
+        since it was last read (its inode or first bytes changed, or it is shorter), it is read
+        again from the start, and self.rewritten is True.
+        '''
+        try:
+            st = os.stat(fname)
+            with open(fname, 'rb') as ifp:
+                head = hashlib.sha1(ifp.read(256)).hexdigest()
+        except OSError:
+            return
+        pos = self.state['files'].get(fname)
+        self.rewritten = bool(pos) and (pos['inode'] != st.st_ino or pos['head'] != head or st.st_size < pos['offset'])
+        offset = 0 if (not pos or self.rewritten) else pos['offset']
+        if offset == st.st_size:
+            return
+        try:
+            for offset, item in reader(fname, offset, **kwargs):
+                yield item
+        finally:
+            self.state['files'][fname] = {'offset': offset, 'inode': st.st_ino, 'head': head}
+
+    def staff(self, username):
+        st = self.state['staff'].get(username)
+        if st is not None:
+            return st
+        return self.state['staff'].setdefault(username, {
+            'saves': 0, 'url_changes': 0, 'url': None, 'last_time': None, 'active_since': None,
+            'active_seconds': 0, 'polls': 0, 'polls_inactive': 0, 'clicks': 0, 'clicks_inactive': 0,
+            'sessions': 0, 'students': {}})
+
+    def add_url_entry(self, username, entry, rewritten=False):
+        '''
+        Count a remote_queue log entry of username: its saved state, preceded by any compacted history
+        States saved no later than the last one counted are skipped, as are states without a save
+        time if the log was rewritten (these were counted when first read).
+        '''
+        st = self.staff(username)
+        for state in (entry['history'] + [entry] if entry.get('history') else (entry,)):
+            t = state.get('time')
+            if t is None:
+                if rewritten:
+                    continue
+            elif st['last_time'] is not None and t <= st['last_time']:
+                continue
+            st['saves'] += 1
+            if st['url'] is not None and state.get('url') != st['url']:
+                st['url_changes'] += 1
+            st['url'] = state.get('url')
+            if t is None:
+                continue
+            if st['active_since'] is not None:
+                st['active_seconds'] += min(t - st['active_since'], self.max_active)
+            st['active_since'] = t if state.get('active') else None
+            st['last_time'] = t
+
+    def add_analytics(self, batch):
+        '''
+        Count a line of the analytics log: {"from": time, "to": time, "counts": [[event, staff, student, session, n], ...]}
+        '''
+        t = batch.get('to') or 0
+        for event, staffuser, student, session, n in batch.get('counts', []):
+            if not staffuser:
+                continue
+            st = self.staff(staffuser)
+            if event == 'get':
+                st['polls'] += n
+            elif event == 'get_inactive':
+                st['polls_inactive'] += n
+            elif event == 'go_inactive':
+                st['clicks_inactive'] += n
+            elif event == 'go':
+                st['clicks'] += n
+                last = st['students'].get(student)
+                if last is None or t - last > self.session_gap:
+                    st['sessions'] += 1
+                st['students'][student] = t
+
+    def add_broadcast(self, course, entry):
+        '''
+        Count a message from course's broadcast log; messages saved to several courses share their version
+        '''
+        key = str(entry.get('version') or entry.get('datetime'))
+        msg = self.state['broadcasts'].setdefault(key, {
+            'version': entry.get('version'), 'datetime': entry.get('datetime'), 'creator': entry.get('creator'),
+            'audience': entry.get('audience') or 'all', 'courses': [], 'expires': entry.get('expires'),
+            'length': len(entry.get('msg') or "")})
+        if course not in msg['courses']:
+            msg['courses'].append(course)
+
+    def staff_rows(self, now=None):
+        now = now or time.time()
+        rows = []
+        for username, st in sorted(self.state['staff'].items()):
+            active = st['active_seconds']
+            if st['active_since'] is not None:
+                active += min(max(now - st['active_since'], 0), self.max_active)
+            rows.append({
+                'staff': username,
+                'saves': st['saves'],
+                'url_changes': st['url_changes'],
+                'active_now': st['active_since'] is not None,
+                'active_hours': round(active / 3600, 2),
+                'polls': st['polls'],
+                'polls_inactive': st['polls_inactive'],
+                'clicks': st['clicks'],
+                'clicks_inactive': st['clicks_inactive'],
+                'click_through': round(st['clicks'] / st['polls'], 3) if st['polls'] else None,
+                'sessions': st['sessions'],
+                'students': len(st['students']),
+            })
+        return rows
+
+    def broadcast_rows(self):
+        rows = []
+        for msg in sorted(self.state['broadcasts'].values(), key=lambda x: (x['datetime'] or "", str(x['version']))):
+            ttl = None
+            if msg['expires'] and msg['datetime']:
+                try:
+                    ttl = round(msg['expires'] - time.mktime(time.strptime(msg['datetime'][:19], "%Y-%m-%d %H:%M:%S")))
+                except ValueError:
+                    pass
+            rows.append(dict(msg, courses=" ".join(msg['courses']), ncourses=len(msg['courses']), ttl=ttl))
+        return rows
+
+#-----------------------------------------------------------------------------
+
+def log_files(cslog):
+    '''
+    Return (list of (staff username, remote_queue log file), list of (course, broadcast log file))
+    '''
+    rq_dir = os.path.dirname(cslog.get_log_filename(REMOTE_QUEUE_DB, [], "x"))
+    logs_root = os.path.dirname(rq_dir)
+    rq_logs = []
+    if os.path.isdir(rq_dir):
+        rq_logs = [(fn[:-4], os.path.join(rq_dir, fn)) for fn in sorted(os.listdir(rq_dir)) if fn.endswith(".log")]
+    bm_logs = []
+    for course in sorted(os.listdir(logs_root)) if os.path.isdir(logs_root) else []:
+        fname = cslog.get_log_filename(course, [BROADCAST_DB], "all")
+        if os.path.exists(fname):
+            bm_logs.append((course, fname))
+    return rq_logs, bm_logs
+
+def write_rows(rows, fmt, ofp):
+    if fmt == "json":
+        json.dump(rows, ofp, indent=1)
+        ofp.write("\n")
+        return
+    if not rows:
+        return
+    writer = csv.DictWriter(ofp, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Report staff remote queue activity and broadcast reach, streamed from the logs")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--catsoop", help="directory containing the catsoop package, whose logs are read")
+    source.add_argument("--data-root", help="read the logs of a scripts/catsoop_harness.py site in this directory")
+    parser.add_argument("--analytics", default="~/cs_remote_queue_analytics.log", help="analytics log (default %(default)s)")
+    parser.add_argument("--report", choices=["staff", "broadcast"], default="staff", help="report to write (default %(default)s)")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv", help="output format (default %(default)s)")
+    parser.add_argument("-o", "--output", help="write the report to this file (default stdout)")
+    parser.add_argument("--state", help="load totals and log offsets from this file (if it exists), and save them back")
+    parser.add_argument("--session-gap", type=float, default=30, help="minutes between a student's clicks which start a new remote session (default %(default)s)")
+    parser.add_argument("--max-active", type=float, default=8, help="hours of a single active interval which count (default %(default)s)")
+    args = parser.parse_args(args)
+
+    if args.catsoop:
+        sys.path.append(args.catsoop)
+        import catsoop.cslog as cslog
+        if cslog.ENCRYPT_KEY is not None:
+            parser.error("encrypted logs cannot be listed")
+        unprep = getattr(cslog, "unprep", pickle.loads)
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from catsoop_harness import LocalCSLog
+        cslog = LocalCSLog(args.data_root)
+        unprep = pickle.loads
+
+    state = None
+    if args.state and os.path.exists(args.state):
+        with open(args.state) as ifp:
+            state = json.load(ifp)
+    report = LogReport(state, session_gap=args.session_gap * 60, max_active=args.max_active * 3600)
+
+    start = time.time()
+    rq_logs, bm_logs = log_files(cslog)
+    for username, fname in rq_logs:
+        for entry in report.read(fname, iter_log, unprep=unprep):
+            report.add_url_entry(username, entry, rewritten=report.rewritten)
+    for batch in report.read(os.path.expanduser(args.analytics), iter_lines):
+        report.add_analytics(batch)
+    for course, fname in bm_logs:
+        for entry in report.read(fname, iter_log, unprep=unprep):
+            report.add_broadcast(course, entry)
+
+    if args.state:
+        tmpfn = args.state + ".tmp"
+        with open(tmpfn, 'w') as ofp:
+            json.dump(report.state, ofp)
+        os.replace(tmpfn, args.state)
+
+    rows = report.staff_rows() if args.report == "staff" else report.broadcast_rows()
+    if args.output:
+        with open(args.output, 'w', newline='') as ofp:
+            write_rows(rows, args.format, ofp)
+    else:
+        write_rows(rows, args.format, sys.stdout)
+    print("read %d remote_queue logs, %d broadcast logs and the analytics log in %.2f s"
+          % (len(rq_logs), len(bm_logs), time.time() - start), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+'''profile_report: merge sampled page load profiles into a hot-path report
+
+The queue plugin can profile a sample of page loads with cProfile (see
+queue_profile_rate in catsoop-queue/catsoop/plugin-template/pre_preload.py),
+saving each profile as a pstats file named <date>-<time>-<pid>-<page>.pstats.
+This script merges such files, and prints:
+
+  - the hot path: starting from the function with the most cumulative
+    time, the chain of callees which each account for the most time
+  - the functions with the most time of their own, and the most
+    cumulative time
+
+    python3 scripts/profile_report.py ~/cs_data/_queue_profiles
+    python3 scripts/profile_report.py -k remote_queue --top 30 ~/cs_data/_queue_profiles
+    python3 scripts/profile_report.py --save merged.pstats a.pstats b.pstats
+
+Directories are searched for *.pstats files; -k keeps only files whose
+names contain the given text (e.g. a page name).
+'''
+import os
+import pstats
+import argparse
+
+def profile_files(paths, filter=""):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, fn) for fn in os.listdir(path) if fn.endswith(".pstats"))
+        else:
+            files.append(path)
+    return [fn for fn in files if filter in os.path.basename(fn)]
+
+def func_name(func):
+    filename, line, name = func
+    if filename == "~":		# built-in
+        return name
+    return "%s:%d(%s)" % (os.path.basename(filename), line, name)
+
+def hot_path(stats, max_depth=25, min_fraction=0.01):
+    '''
+    Return list of (func, cumulative time) along the hot path of stats
+    '''
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]	# cumulative time of func when called by caller
+    if not stats.stats:
+        return []
+    func = max(stats.stats, key=lambda f: stats.stats[f][3])
+    total = stats.stats[func][3]
+    path = [(func, total)]
+    seen = {func}
+    while len(path) < max_depth:
+        candidates = [(ct, f) for f, ct in callees.get(func, {}).items() if f not in seen]
+        if not candidates:
+            break
+        ct, func = max(candidates)
+        if ct < min_fraction * total:
+            break
+        path.append((func, ct))
+        seen.add(func)
+    return path
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Merge pstats files of sampled page loads into a hot-path report")
+    parser.add_argument("paths", nargs="+", help="pstats files, or directories of them")
+    parser.add_argument("-k", dest="filter", default="", help="only use files whose names contain this")
+    parser.add_argument("--top", type=int, default=20, help="functions to list by own and cumulative time (default %(default)s)")
+    parser.add_argument("--save", help="also save the merged profile to this pstats file")
+    args = parser.parse_args(args)
+
+    files = profile_files(args.paths, args.filter)
+    if not files:
+        parser.error("no profiles found")
+    stats = pstats.Stats(files[0])
+    for fn in files[1:]:
+        stats.add(fn)
+    if args.save:
+        stats.dump_stats(args.save)
+
+    print("%d profiles, %.3f s total\n" % (len(files), stats.total_tt))
+    print("hot path (cumulative s, % of top):")
+    path = hot_path(stats)
+    for depth, (func, ct) in enumerate(path):
+        print("%9.3f %5.1f%%  %s%s" % (ct, 100 * ct / path[0][1], "  " * depth, func_name(func)))
+
+    for title, key in [("own time", 2), ("cumulative time", 3)]:
+        print("\ntop %d functions by %s:" % (args.top, title))
+        print("%9s %9s %9s  %s" % ("calls", "own s", "cum s", "function"))
+        ranked = sorted(stats.stats.items(), key=lambda x: x[1][key], reverse=True)[:args.top]
+        for func, (cc, nc, tt, ct, callers) in ranked:
+            print("%9d %9.3f %9.3f  %s" % (nc, tt, ct, func_name(func)))
+
+if __name__ == "__main__":
+    main()